@@ -0,0 +1,351 @@
+"""
+asyncio engine for the Blackijecky server.
+
+Runs every session as a coroutine on a single event loop instead of one OS
+thread per connection, so a single process can hold tens of thousands of
+idle-between-decisions players. The wire protocol is identical to the
+threaded BlackjackServer.
+"""
+import asyncio
+import socket
+import time
+from constants import *
+from server import BlackjackServer, SessionEvicted, session_deadline, check_deadline, STREAM_FLUSH_BYTES
+from scoring import HandState, CARD_ID_VALUES, NO_CARD, play_dealer, settle
+from shoe import PRIVATE_RESERVE
+from table import TableScheduler
+from protocol import PayloadBatch, HEADER_STRUCT, REQUEST_BODIES, DECISION_STRUCT
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def raise_nofile_limit():
+    """
+    Raise the soft open-file limit to the hard limit.
+
+    Every session holds one socket, so the default soft limit (often 1024)
+    is the first thing that breaks with thousands of concurrent players.
+    """
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+
+class AsyncBlackjackServer(BlackjackServer):
+    def __init__(self, *args, table_size=1, **kwargs):
+        """
+        Args:
+            table_size: Seats per shared table; 1 gives every session a private dealer
+        """
+        super().__init__(*args, **kwargs)
+        self._loop = None
+        self._closing = None
+        self.tables = TableScheduler(self, table_size) if table_size > 1 else None
+
+    def start(self, broadcast=True):
+        self.log(f"Server started, listening on IP address {self.get_local_ip()}") # [cite: 69]
+        self.start_metrics()
+        raise_nofile_limit()
+        asyncio.run(self.serve(broadcast))
+        if self.round_log is not None:
+            self.round_log.close()
+
+    def stop(self):
+        """Thread- and signal-safe: wake the event loop and begin draining (see BlackjackServer.stop)."""
+        super().stop()
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._closing.set)
+
+    async def serve(self, broadcast=True):
+        self._loop = asyncio.get_running_loop()
+        self._closing = asyncio.Event()
+        sessions = set()
+
+        def on_connect(reader, writer):
+            if not self.open_session():
+                # At capacity: refuse before spending a coroutine on it
+                self.stats.incr('rejected')
+                writer.close()
+                return
+            session = asyncio.create_task(self.handle_client(reader, writer))
+            sessions.add(session)
+            session.add_done_callback(sessions.discard)
+
+        # Reuse the listening socket bound in BlackjackServer.__init__
+        self.tcp_sock.setblocking(False)
+        tcp_server = await asyncio.start_server(on_connect, sock=self.tcp_sock)
+        offer_task = asyncio.create_task(self.broadcast_offers(self.open_broadcaster())) if broadcast else None
+        if not self.running:
+            self._closing.set()
+        try:
+            await self._closing.wait()
+        finally:
+            # Graceful shutdown: no new players, let running sessions finish
+            backlog = list(self.accept_backlog())
+            tcp_server.close()
+            for client_sock, _ in backlog:
+                on_connect(*await asyncio.open_connection(sock=client_sock))
+            if offer_task is not None:
+                offer_task.cancel()
+            self.log(f"Draining {self.active_sessions} sessions")
+            if sessions:
+                _, late = await asyncio.wait(sessions, timeout=self.drain_wait())
+                for session in late:
+                    # Past the grace period: closing is all that is left
+                    self.stats.incr('evicted_drain')
+                    session.cancel()
+                if late:
+                    await asyncio.wait(late)
+
+    async def broadcast_offers(self, broadcaster):
+        """Sends UDP offers every offer_interval seconds; discover requests are answered as they arrive."""
+        loop = asyncio.get_running_loop()
+        if broadcaster.discovery_sock is not None:
+            loop.add_reader(broadcaster.discovery_sock, broadcaster.answer)
+        try:
+            while self.running:
+                await asyncio.sleep(broadcaster.tick())
+        finally:
+            if broadcaster.discovery_sock is not None:
+                loop.remove_reader(broadcaster.discovery_sock)
+            broadcaster.close()
+
+    async def handle_client(self, reader, writer):
+        self.log(f"New connection from {writer.get_extra_info('peername')}")
+        try:
+            writer.get_extra_info('socket').setsockopt(
+                socket.IPPROTO_TCP, socket.TCP_NODELAY, int(self.tcp_nodelay))
+            # drain() pauses dealing to this connection above the high-water mark. The low mark is
+            # the same, so the transport is paused exactly while the buffer is above it (the
+            # default low mark, high / 4, would keep it paused after drain() takes its fast path)
+            writer.transport.set_write_buffer_limits(high=self.write_high_water, low=self.write_high_water)
+
+            # One outgoing buffer and shoe reused for every round and keep-alive session
+            batch = PayloadBatch()
+            shoe = self.new_shoe()
+            first = True
+            # While draining, a finished session is not followed by another on the connection
+            while await self.serve_session(reader, writer, batch, shoe, first) and self.keep_alive and self.running:
+                first = False
+
+        except SessionEvicted as e:
+            self.evict(e)
+            if e.reason == 'evicted_write':
+                writer.transport.abort()  # Drop what the client would not read
+        except Exception as e:
+            self.protocol_error('error_client', f"Client error: {e}")
+        finally:
+            # close() keeps the transport until its buffer is written; bound that too
+            writer.close()
+            try:
+                await asyncio.wait_for(writer.wait_closed(), self.write_timeout)
+            except asyncio.TimeoutError:
+                writer.transport.abort()
+            except Exception:
+                pass
+            self.close_session()
+
+    async def serve_session(self, reader, writer, batch, shoe, first=True):
+        """
+        Coroutine version of BlackjackServer.serve_session.
+
+        Returns:
+            bool: True if every round was played, so another request may follow
+        """
+        # 1. Receive Request Message (TCP): common header, then the body for its type
+        # v1: Cookie(4), Type(1), Rounds(1), Name(32) [cite: 91-95]
+        # v2: Cookie(4), Type(1), Rounds(4), Name(32), Hard policy(10), Soft policy(10)
+        try:
+            header = await asyncio.wait_for(reader.readexactly(HEADER_STRUCT.size), self.idle_timeout)
+            cookie, msg_type = HEADER_STRUCT.unpack(header)
+
+            if cookie != MAGIC_COOKIE:
+                self.protocol_error('error_cookie', f"Invalid magic cookie received: {hex(cookie)}")
+                return False
+
+            if msg_type not in REQUEST_BODIES:
+                self.protocol_error('error_type', f"Invalid message type received: {hex(msg_type)}")
+                return False
+
+            layout = REQUEST_BODIES[msg_type]
+            body = layout.unpack(await asyncio.wait_for(reader.readexactly(layout.size), self.idle_timeout))
+        except asyncio.TimeoutError:
+            raise SessionEvicted('evicted_idle')
+        except asyncio.IncompleteReadError as e:
+            # A keep-alive client closing between sessions is the normal way to finish
+            if first or e.partial:
+                self.protocol_error('error_incomplete', "Received incomplete request packet")
+            return False
+        self.stats.incr('bytes_received', HEADER_STRUCT.size + layout.size)
+
+        rounds, team_name = body[:2]
+        team_name = team_name.decode('utf-8').strip('\x00')
+        self.log(f"Starting game with {team_name} for {rounds} rounds")
+        self.stats.incr('sessions')
+        deadline = session_deadline(self.session_timeout)
+        number = next(self.session_numbers)
+
+        # 2. Game Logic Loop: streamed, at a shared table if enabled, or private
+        if msg_type == MSG_TYPE_REQUEST_V2:
+            # Needs no decisions, so it never takes a seat at a shared table
+            await self.stream_rounds(writer, rounds, *body[2:], deadline, batch, shoe, number, body[1])
+        elif self.tables is not None:
+            if not await self.tables.play(reader, writer, team_name, rounds, deadline, number):
+                return False
+        else:
+            for i in range(rounds):
+                self.check_drain()
+                started = time.perf_counter()
+                alive = await self.play_round(reader, writer, batch, shoe, deadline, number, body[1])
+                self.round_time.observe(time.perf_counter() - started)
+                if not alive:
+                    return False
+
+        self.log(f"Finished playing with {team_name}")
+        return True
+
+    def write_batch(self, writer, batch):
+        """Hand a PayloadBatch's packets to the transport, counted in bytes_sent."""
+        self.stats.incr('bytes_sent', len(batch))
+        writer.write(batch.take())
+
+    async def drain(self, writer):
+        """
+        writer.drain(), bounded: returns at once at or below the high-water mark, where
+        the transport (low mark = high mark, see handle_client) is never paused.
+
+        Raises:
+            SessionEvicted: if the client leaves the buffer above the mark for write_timeout
+        """
+        if writer.transport.get_write_buffer_size() <= self.write_high_water:
+            await writer.drain()
+            return
+        try:
+            await asyncio.wait_for(writer.drain(), self.write_timeout)
+        except asyncio.TimeoutError:
+            raise SessionEvicted('evicted_write')
+
+    async def stream_rounds(self, writer, rounds, hard, soft, deadline=None, batch=None, shoe=None,
+                            session=0, team=b''):
+        """Coroutine version of BlackjackServer.stream_rounds."""
+        if batch is None:
+            batch = PayloadBatch()
+        if shoe is None:
+            shoe = self.new_shoe()
+        for i in range(rounds):
+            self.play_policy_round(shoe, batch, hard, soft, session, team)
+            if len(batch) >= STREAM_FLUSH_BYTES or i == rounds - 1:
+                check_deadline(deadline)
+                self.write_batch(writer, batch)
+                await self.drain(writer)
+                # drain() returns at once below the high-water mark; let other sessions run
+                await asyncio.sleep(0)
+                if i < rounds - 1:
+                    self.check_drain()
+
+    async def play_round(self, reader, writer, batch=None, shoe=None, deadline=None, session=0, team=b''):
+        """
+        Coroutine version of BlackjackServer.play_round.
+
+        Returns:
+            bool: False if the client went away mid-round, True otherwise
+
+        Raises:
+            SessionEvicted: if a decision or the session deadline runs out
+        """
+        if batch is None:
+            batch = PayloadBatch()
+        if shoe is None:
+            shoe = self.new_shoe()
+        check_deadline(deadline)
+
+        def send_payload(status, card):
+            # Same 9-byte packet as the threaded server, queued until flush()
+            rank, suit = self.encode_card_for_network(card)
+            batch.add(status, rank, suit)
+
+        async def flush():
+            self.write_batch(writer, batch)
+            await self.drain(writer)
+
+        # Initial deal from the table's shoe
+        shoe.start_round(PRIVATE_RESERVE)
+        player_first, player_second = shoe.deal(), shoe.deal()
+        dealer_up_card, dealer_hole_card = shoe.deal(), shoe.deal()  # Hole card is hidden initially
+
+        player_hand = HandState(CARD_ID_VALUES[player_first], CARD_ID_VALUES[player_second])
+        player_sum = player_hand.total
+        hits = decisions = 0  # For the round log
+
+        # Player's two cards, then the dealer's visible up-card
+        send_payload(RESULT_CONTINUE, player_first)
+        send_payload(RESULT_CONTINUE, player_second)
+        send_payload(RESULT_CONTINUE, dealer_up_card)
+
+        # Player turn
+        while True:
+            if player_sum > 21:
+                send_payload(RESULT_LOSS, NO_CARD)
+                self.record_result(RESULT_LOSS)
+                self.log_round(session, team, shoe, hits, decisions, RESULT_LOSS)
+                await flush()
+                return True
+
+            await flush()
+
+            # Receive client decision: Cookie(4) + Type(1) + Decision(5) = 10 bytes
+            timeout, reason = self.decision_timeout_for(deadline)
+            waiting_since = time.perf_counter()
+            try:
+                decision_raw = await asyncio.wait_for(reader.readexactly(10), timeout)
+            except asyncio.TimeoutError:
+                raise SessionEvicted(reason)
+            except asyncio.IncompleteReadError:
+                self.protocol_error('error_disconnected', "Client disconnected or sent incomplete decision packet")
+                return False
+            self.decision_wait.observe(time.perf_counter() - waiting_since)
+            self.stats.incr('bytes_received', DECISION_STRUCT.size)
+
+            cookie, msg_type, decision_bytes = DECISION_STRUCT.unpack(decision_raw)
+
+            if cookie != MAGIC_COOKIE:
+                self.protocol_error('error_cookie', f"Invalid magic cookie in decision: {hex(cookie)}")
+                return False
+
+            if msg_type != MSG_TYPE_PAYLOAD:
+                self.protocol_error('error_type', f"Invalid message type in decision: {hex(msg_type)}")
+                return False
+
+            decision = decision_bytes.decode('utf-8', errors='ignore').strip('\x00').lower()
+            decisions += 1
+
+            if decision.startswith('h'):
+                hits |= 1 << (decisions - 1)
+                new_card = shoe.deal()
+                player_sum = player_hand.add(CARD_ID_VALUES[new_card])
+                send_payload(RESULT_CONTINUE, new_card)
+            else:
+                # Stand - treat anything else as stand
+                break
+
+        # Dealer turn: reveal the hidden card, then the dealer's hits
+        dealer_sum, dealer_hits = play_dealer(dealer_up_card, dealer_hole_card, shoe.deal)
+        send_payload(RESULT_CONTINUE, dealer_hole_card)
+        for new_card in dealer_hits:
+            send_payload(RESULT_CONTINUE, new_card)
+
+        result = settle(player_sum, dealer_sum)
+
+        send_payload(result, NO_CARD)
+        self.record_result(result)
+        self.log_round(session, team, shoe, hits, decisions, result)
+        await flush()
+        return True
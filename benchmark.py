@@ -0,0 +1,394 @@
+"""
+Benchmark suite for Blackijecky hot paths, run entirely on localhost.
+
+Microbenchmarks report the best per-operation time over several repeats.
+The legacy_* functions reproduce the original per-card implementations so
+the table-driven versions have something to be measured against.
+
+End-to-end benchmarks (--e2e) start a server in a child process and drive
+it with loadgen bots at 1, 100 and 5000 concurrent clients, reporting
+sessions and rounds per second.
+
+Results can be written as JSON (--json) and compared against a JSON file
+saved by an earlier run (--baseline); the exit status is 1 when anything
+regressed beyond --tolerance.
+"""
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import platform
+import random
+import secrets
+import socket
+import sys
+import threading
+import time
+import timeit
+from array import array
+from constants import *
+from protocol import PAYLOAD_STRUCT, PayloadBatch, RecvBuffer
+from rng import thread_rng
+from scoring import DECK_CARDS, HandState, encode_card, decode_card, hand_value
+from shoe import Shoe, PRIVATE_RESERVE
+
+
+def legacy_build_deck():
+    deck = []
+    for _ in range(4):
+        deck.extend([2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10, CARD_VALUE_ACE])
+    random.shuffle(deck)
+    return deck
+
+
+def legacy_encode_card(card_value):
+    suit = random.randint(0, 3)
+    if card_value == CARD_VALUE_ACE:
+        rank = RANK_ACE
+    elif card_value == 10:
+        rank = random.choice([10, RANK_JACK, RANK_QUEEN, RANK_KING])
+    else:
+        rank = card_value
+    return rank, suit
+
+
+def legacy_decode_card(rank, suit):
+    if rank == RANK_ACE:
+        card_value = CARD_VALUE_ACE
+        rank_str = "A"
+    elif rank >= RANK_JACK:
+        card_value = 10
+        rank_str = {RANK_JACK: "J", RANK_QUEEN: "Q", RANK_KING: "K"}.get(rank, str(rank))
+    else:
+        card_value = rank
+        rank_str = str(rank)
+    suit_symbol = SUIT_SYMBOLS[suit] if 0 <= suit <= 3 else "?"
+    return card_value, f"{rank_str}{suit_symbol}"
+
+
+# Fixed card sequences so every run measures the same work
+_rng = random.Random(1234)
+CARD_SAMPLE = [_rng.choice([2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10, CARD_VALUE_ACE]) for _ in range(1000)]
+WIRE_SAMPLE = [legacy_encode_card(card) for card in CARD_SAMPLE]
+CARD_ID_SAMPLE = [(rank << 2) | suit for rank, suit in WIRE_SAMPLE]
+ROUNDS_SAMPLE = 100
+CARDS_PER_ROUND = 6  # Typical round: 2 + 2 initial cards and a couple of hits
+HAND_SAMPLE = [CARD_SAMPLE[i:i + 4] for i in range(0, len(CARD_SAMPLE), 4)]
+
+
+def bench_legacy_encode():
+    for card in CARD_SAMPLE:
+        legacy_encode_card(card)
+
+
+def bench_encode():
+    for card in CARD_ID_SAMPLE:
+        encode_card(card)
+
+
+def bench_legacy_deal():
+    # Fresh shuffled deck per round, then encode the dealt values
+    for _ in range(ROUNDS_SAMPLE):
+        deck = legacy_build_deck()
+        for _ in range(CARDS_PER_ROUND):
+            legacy_encode_card(deck.pop())
+
+
+def bench_shoe_deal(shoe=Shoe(decks=6, penetration=0.75, seed=1)):
+    for _ in range(ROUNDS_SAMPLE):
+        shoe.start_round(PRIVATE_RESERVE)
+        for _ in range(CARDS_PER_ROUND):
+            encode_card(shoe.deal())
+
+
+def bench_legacy_decode():
+    for rank, suit in WIRE_SAMPLE:
+        legacy_decode_card(rank, suit)
+
+
+def bench_decode():
+    for rank, suit in WIRE_SAMPLE:
+        decode_card(rank, suit)
+
+
+def bench_legacy_hand_value():
+    # Rescan the whole hand after every card, as play_round used to
+    for hand in HAND_SAMPLE:
+        cards = []
+        for card in hand:
+            cards.append(card)
+            hand_value(cards)
+
+
+def bench_hand_state():
+    for hand in HAND_SAMPLE:
+        state = HandState()
+        for card in hand:
+            state.add(card)
+
+
+def bench_legacy_pack():
+    # One struct.pack per packet, joined for the send
+    packets = []
+    for rank, suit in WIRE_SAMPLE:
+        packets.append(PAYLOAD_STRUCT.pack(MAGIC_COOKIE, MSG_TYPE_PAYLOAD, RESULT_CONTINUE, rank, suit))
+    b"".join(packets)
+
+
+def bench_batch_pack(batch=PayloadBatch()):
+    for rank, suit in WIRE_SAMPLE:
+        batch.add(RESULT_CONTINUE, rank, suit)
+    batch.take()
+
+
+SHOE_SAMPLE = array('B', DECK_CARDS * 6)
+
+
+def bench_legacy_shuffle(rng=random.Random()):
+    # What Shoe did before rng.py: reseed from secrets, then random.shuffle
+    rng.seed(secrets.randbits(128))
+    rng.shuffle(SHOE_SAMPLE)
+
+
+def bench_bulk_shuffle():
+    thread_rng().shuffle(SHOE_SAMPLE)
+
+
+# The sample as it arrives on the wire, for the parse loops
+WIRE_STREAM = b"".join(PAYLOAD_STRUCT.pack(MAGIC_COOKIE, MSG_TYPE_PAYLOAD, RESULT_CONTINUE, rank, suit)
+                       for rank, suit in WIRE_SAMPLE)
+
+
+def bench_legacy_unpack():
+    # Slice each packet off the front of a bytes buffer
+    data = WIRE_STREAM
+    while len(data) >= PAYLOAD_STRUCT.size:
+        PAYLOAD_STRUCT.unpack(data[:PAYLOAD_STRUCT.size])
+        data = data[PAYLOAD_STRUCT.size:]
+
+
+def bench_buffer_unpack(recv_buffer=RecvBuffer(len(WIRE_STREAM))):
+    # The client's handle_gameplay loop: unpack_from at a cursor
+    recv_buffer.buffer[:len(WIRE_STREAM)] = WIRE_STREAM
+    recv_buffer.start, recv_buffer.end = 0, len(WIRE_STREAM)
+    for packet in recv_buffer.packets(PAYLOAD_STRUCT):
+        pass
+
+
+# name -> (function, operations per call)
+BENCHMARKS = {
+    'encode_card.legacy': (bench_legacy_encode, len(CARD_SAMPLE)),
+    'encode_card.table': (bench_encode, len(CARD_SAMPLE)),
+    'deal.legacy': (bench_legacy_deal, ROUNDS_SAMPLE * CARDS_PER_ROUND),
+    'deal.shoe': (bench_shoe_deal, ROUNDS_SAMPLE * CARDS_PER_ROUND),
+    'decode_card.legacy': (bench_legacy_decode, len(WIRE_SAMPLE)),
+    'decode_card.table': (bench_decode, len(WIRE_SAMPLE)),
+    'hand_value.rescan': (bench_legacy_hand_value, len(CARD_SAMPLE)),
+    'hand_value.incremental': (bench_hand_state, len(CARD_SAMPLE)),
+    'pack.legacy': (bench_legacy_pack, len(WIRE_SAMPLE)),
+    'pack.batch': (bench_batch_pack, len(WIRE_SAMPLE)),
+    'unpack.legacy': (bench_legacy_unpack, len(WIRE_SAMPLE)),
+    'unpack.buffer': (bench_buffer_unpack, len(WIRE_SAMPLE)),
+    'shuffle.legacy': (bench_legacy_shuffle, 1),
+    'shuffle.bulk': (bench_bulk_shuffle, 1),
+}
+
+# Threads shuffling six-deck shoes at once, and shuffles shared between them per run
+CONTENTION_THREADS = (1, 8, 64)
+CONTENTION_SHUFFLES = 4096
+
+# (concurrent bots, rounds per bot, seconds to ramp connections over)
+E2E_SCENARIOS = [
+    (1, 2000, 0.0),
+    (100, 100, 0.0),
+    (5000, 10, 0.5),  # Spread the connects so the accept backlog never overflows
+]
+
+# Whether a bigger number is better, by unit
+HIGHER_IS_BETTER = {'ns/op': False, 'ms': False, 'rounds/s': True, 'sessions/s': True, 'shuffles/s': True,
+                    'errors': False}
+
+
+def run_benchmark(function, operations, repeat=5, number=20):
+    """Best-of-`repeat` time per operation, in nanoseconds."""
+    best = min(timeit.repeat(function, repeat=repeat, number=number))
+    return best / (number * operations) * 1e9
+
+
+def run_contention(threads, shuffle, total=CONTENTION_SHUFFLES):
+    """
+    Shuffles per second with `threads` threads shuffling their own shoes at once.
+
+    Args:
+        shuffle: Callable shuffling a card array in place
+    """
+    per_thread = total // threads
+    barrier = threading.Barrier(threads + 1)
+
+    def worker():
+        cards = array('B', SHOE_SAMPLE)
+        barrier.wait()
+        for _ in range(per_thread):
+            shuffle(cards)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for worker_thread in workers:
+        worker_thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for worker_thread in workers:
+        worker_thread.join()
+    return per_thread * threads / (time.perf_counter() - started)
+
+
+def _serve(mode, port):
+    # Child process: a quiet server without UDP offers, so only the bots reach it
+    from async_server import raise_nofile_limit
+    raise_nofile_limit()
+    if mode == "async":
+        from async_server import AsyncBlackjackServer
+        server = AsyncBlackjackServer(tcp_port=port, verbose=False)
+    else:
+        from server import BlackjackServer
+        server = BlackjackServer(tcp_port=port, verbose=False)
+    server.start(broadcast=False)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode, timeout=10.0):
+    """
+    Start a server in a child process and wait until it accepts connections.
+
+    Returns:
+        tuple: (process, port)
+    """
+    port = free_port()
+    process = multiprocessing.Process(target=_serve, args=(mode, port), daemon=True)
+    process.start()
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1.0).close()
+            return process, port
+        except OSError:
+            if time.monotonic() > deadline or not process.is_alive():
+                process.terminate()
+                raise RuntimeError(f"{mode} server did not start on port {port}")
+            time.sleep(0.05)
+
+
+def run_e2e(mode, strategy):
+    """
+    Drive a fresh server per scenario with loadgen bots.
+
+    Returns:
+        dict: name -> {'value', 'unit'} for throughput, p99 latency and errors
+    """
+    from loadgen import run_load
+    from async_server import raise_nofile_limit
+    raise_nofile_limit()
+    results = {}
+    for clients, rounds, ramp in E2E_SCENARIOS:
+        process, port = start_server(mode)
+        try:
+            report = asyncio.run(run_load("127.0.0.1", port, clients, rounds, strategy, ramp))
+        finally:
+            process.terminate()
+            process.join()
+        prefix = f"e2e.{mode}.{clients}"
+        results[f"{prefix}.rounds_per_s"] = {'value': report['rounds_per_s'], 'unit': 'rounds/s'}
+        results[f"{prefix}.sessions_per_s"] = {'value': report['sessions'] / report['elapsed_s'],
+                                               'unit': 'sessions/s'}
+        results[f"{prefix}.latency_p99"] = {'value': report['latency_p99_ms'], 'unit': 'ms'}
+        errors = sum(report['errors'].values())
+        results[f"{prefix}.errors"] = {'value': errors, 'unit': 'errors'}
+        print(f"{prefix:<28} {report['rounds_per_s']:8.0f} rounds/s  "
+              f"{report['sessions'] / report['elapsed_s']:8.1f} sessions/s  "
+              f"p99 {report['latency_p99_ms']:6.2f} ms" + (f"  errors {errors}" if errors else ""))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results against a baseline run.
+
+    Returns:
+        list: (name, baseline value, new value, relative change, regressed) per shared benchmark,
+        with change signed so that positive is always an improvement
+    """
+    rows = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None or old['unit'] != result['unit']:
+            continue
+        if old['value']:
+            change = (result['value'] - old['value']) / old['value']
+        else:
+            # Nothing to scale by: any move away from zero (errors appearing) is an infinite change
+            change = 0.0 if result['value'] == old['value'] else math.copysign(math.inf, result['value'])
+        if not HIGHER_IS_BETTER[result['unit']]:
+            change = -change
+        rows.append((name, old['value'], result['value'], change, change < -tolerance))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Blackijecky benchmark suite")
+    parser.add_argument("pattern", nargs="?", default="", help="only run microbenchmarks containing this text")
+    parser.add_argument("--e2e", action="store_true", help="also run end-to-end server benchmarks")
+    parser.add_argument("--mode", choices=["async", "threaded"], action="append",
+                        help="server engine for --e2e (repeatable, default: async)")
+    parser.add_argument("--contention", action="store_true",
+                        help="also compare the shared random module with per-thread generators "
+                             "across thread counts")
+    parser.add_argument("--json", metavar="PATH", help="write results as JSON")
+    parser.add_argument("--baseline", metavar="PATH", help="compare against JSON from an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="relative slowdown reported as a regression (default: 0.10)")
+    args = parser.parse_args()
+
+    results = {}
+    for name, (function, operations) in BENCHMARKS.items():
+        if args.pattern in name:
+            ns = run_benchmark(function, operations)
+            results[name] = {'value': ns, 'unit': 'ns/op'}
+            print(f"{name:<28} {ns:8.1f} ns/op")
+
+    if args.contention:
+        # The module-level generator every thread shares, against each thread's own
+        for kind, shuffle in (('shared', random.shuffle), ('thread', lambda cards: thread_rng().shuffle(cards))):
+            for threads in CONTENTION_THREADS:
+                name = f"shuffle.{kind}.{threads}threads"
+                rate = run_contention(threads, shuffle)
+                results[name] = {'value': rate, 'unit': 'shuffles/s'}
+                print(f"{name:<28} {rate:8.0f} shuffles/s")
+
+    if args.e2e:
+        from strategy import basic_strategy
+        for mode in args.mode or ["async"]:
+            results.update(run_e2e(mode, basic_strategy))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                'python': sys.version.split()[0],
+                'platform': platform.platform(),
+                'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                'results': results,
+            }, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        rows = compare(results, baseline, args.tolerance)
+        print(f"\nAgainst {args.baseline}:")
+        for name, old, new, change, regressed in rows:
+            print(f"{name:<28} {old:10.1f} -> {new:10.1f}  {change:+7.1%}" + ("  REGRESSION" if regressed else ""))
+        if any(row[4] for row in rows):
+            sys.exit(1)
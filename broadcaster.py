@@ -0,0 +1,185 @@
+"""
+Offer broadcaster for Blackijecky servers.
+
+Offers go to every configured target: the limited broadcast address by
+default, or any mix of subnet broadcast, unicast and multicast addresses,
+each optionally sent from a given interface address so clients on that
+segment see a source IP they can connect back to. Each target keeps its
+own socket and resolved address, built once, so a tick is one sendto per
+target; the offer itself is packed once and only rebuilt per tick when it
+carries load hints.
+
+Ticks are interval seconds apart with random jitter, so servers started
+together do not send in lockstep. A target whose sendto fails backs off
+exponentially (up to MAX_BACKOFF) instead of retrying every tick, and the
+other targets keep their schedule. Clients that do not want to wait for
+the next tick send a discover request to DISCOVERY_PORT and get the offer
+straight back.
+
+Both engines share this class: the threaded server runs run() on its own
+thread, the asyncio server drives tick() and answer() from its event loop.
+"""
+import ipaddress
+import random
+import select
+import socket
+import time
+from collections import namedtuple
+from constants import *
+from protocol import DISCOVER_PACKET
+
+MAX_BACKOFF = 30.0          # Longest pause, in seconds, for a target whose sends keep failing
+DISCOVER_REPLY_LIMIT = 64   # Discover replies per second; the rest are dropped, not queued
+MULTICAST_TTL = 1           # Default hops for multicast offers: the local segment only
+
+# host is an IP, host name or <broadcast>; interface is a local IP to send from, or None
+OfferTarget = namedtuple('OfferTarget', 'host port interface')
+DEFAULT_TARGETS = (OfferTarget('<broadcast>', UDP_PORT, None),)
+
+
+def parse_target(text):
+    """
+    Parse an offer target given as HOST[:PORT][@INTERFACE_IP].
+
+    Returns:
+        OfferTarget: port defaults to UDP_PORT
+    """
+    host, _, interface = text.partition('@')
+    host, _, port = host.partition(':')
+    return OfferTarget(host or '<broadcast>', int(port) if port else UDP_PORT, interface or None)
+
+
+class _Target:
+    """Socket, resolved address and backoff state for one OfferTarget."""
+
+    def __init__(self, target, multicast_ttl):
+        self.label = f"{target.host}:{target.port}" + (f"@{target.interface}" if target.interface else "")
+        host = '255.255.255.255' if target.host == '<broadcast>' else socket.gethostbyname(target.host)
+        self.address = (host, target.port)
+        self.interface = target.interface
+        self.multicast = ipaddress.ip_address(host).is_multicast
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        if self.multicast:
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, multicast_ttl)
+            if target.interface:
+                self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(target.interface))
+        else:
+            # Subnet broadcast addresses look like any other address, so always allow broadcast
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            if target.interface:
+                self.sock.bind((target.interface, 0))
+        self.failures = 0
+        self.retry_at = 0.0
+
+
+class OfferBroadcaster:
+    def __init__(self, build_packet, targets=None, interval=1.0, jitter=0.1, refresh=False,
+                 discovery_port=DISCOVERY_PORT, multicast_ttl=MULTICAST_TTL, log=print):
+        """
+        Args:
+            build_packet: Callable returning the offer packet
+            targets: OfferTargets to send to (default: the limited broadcast address)
+            interval: Seconds between offers
+            jitter: Each interval is randomly stretched or shrunk by up to this fraction
+            refresh: Rebuild the packet every tick (offers with load hints); otherwise build it once
+            discovery_port: UDP port to answer discover requests on; None disables them
+        """
+        self.build_packet = build_packet
+        self.refresh = refresh
+        self.packet = build_packet()
+        self.interval = interval
+        self.jitter = jitter
+        self.log = log
+        self.targets = [_Target(target, multicast_ttl) for target in (targets or DEFAULT_TARGETS)]
+        self.next_tick = 0.0
+        self._replies = 0
+        self._reply_window = 0.0
+        self.discovery_sock = None
+        if discovery_port is not None:
+            self.discovery_sock = self.open_discovery_socket(discovery_port)
+
+    def open_discovery_socket(self, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # Several servers on one host all hear broadcast and multicast discover requests
+        reuse_opt = getattr(socket, "SO_REUSEPORT", socket.SO_REUSEADDR)
+        sock.setsockopt(socket.SOL_SOCKET, reuse_opt, 1)
+        sock.setblocking(False)
+        sock.bind(('', port))
+        for target in self.targets:
+            if target.multicast:
+                # Also answer requests sent to the groups the offers go to
+                membership = socket.inet_aton(target.address[0]) + socket.inet_aton(target.interface or '0.0.0.0')
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        return sock
+
+    def next_interval(self):
+        return self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def tick(self):
+        """
+        Send the offer to every target that is due.
+
+        Returns:
+            float: Seconds until the next tick
+        """
+        now = time.monotonic()
+        if now < self.next_tick:
+            return self.next_tick - now
+        if self.refresh:
+            self.packet = self.build_packet()  # Load hints change between offers
+        for target in self.targets:
+            if now < target.retry_at:
+                continue
+            try:
+                target.sock.sendto(self.packet, target.address)
+            except OSError as e:
+                target.failures += 1
+                delay = min(self.interval * 2 ** target.failures, MAX_BACKOFF)
+                target.retry_at = now + delay
+                self.log(f"Broadcasting error to {target.label}: {e}; retrying in {delay:.1f}s")
+                continue
+            if target.failures:
+                self.log(f"Offers to {target.label} resumed after {target.failures} failed attempts")
+                target.failures = 0
+        self.next_tick = now + self.next_interval()
+        return self.next_tick - now
+
+    def answer(self):
+        """Reply to every discover request waiting on the discovery socket."""
+        while True:
+            try:
+                data, addr = self.discovery_sock.recvfrom(BUFFER_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                continue  # e.g. an ICMP error left over from an earlier reply
+            if data[:len(DISCOVER_PACKET)] != DISCOVER_PACKET:
+                continue
+            now = time.monotonic()
+            if now - self._reply_window >= 1.0:
+                self._reply_window, self._replies = now, 0
+            if self._replies >= DISCOVER_REPLY_LIMIT:
+                continue  # Spoofed-source floods must not turn us into an amplifier
+            self._replies += 1
+            try:
+                self.discovery_sock.sendto(self.build_packet() if self.refresh else self.packet, addr)
+            except OSError:
+                pass
+
+    def run(self, keep_running):
+        """Send offers and answer discover requests until keep_running() is false."""
+        readers = [self.discovery_sock] if self.discovery_sock is not None else []
+        while keep_running():
+            # Wake up at least twice a second so a stop is noticed
+            timeout = min(self.tick(), 0.5)
+            if not readers:
+                time.sleep(timeout)
+            elif select.select(readers, [], [], timeout)[0]:
+                self.answer()
+
+    def close(self):
+        for target in self.targets:
+            target.sock.close()
+        if self.discovery_sock is not None:
+            self.discovery_sock.close()
@@ -1,74 +1,133 @@
 import socket
-import struct
 from constants import *
+from protocol import REQUEST_STRUCT, REQUEST_V2_STRUCT, DECISION_STRUCT, PAYLOAD_STRUCT, RecvBuffer
+from scoring import HandState, decode_card
+from strategy import hit_below_policy, STRATEGIES
+
+# Display only; never built when the client is not verbose
+OUTCOME_MESSAGES = {
+    RESULT_WIN: "You win! 🎉",
+    RESULT_LOSS: "You lose.",
+    RESULT_TIE: "Tie.",
+}
 
 class BlackjackClient:
-    def __init__(self, num_rounds=None):
+    def __init__(self, num_rounds=None, strategy=None, verbose=True, stream=False, sessions=1, offer_groups=()):
+        """
+        Args:
+            num_rounds: Rounds to request per session (1-255, up to 2**32 - 1 when streaming)
+            strategy: Headless decision callable (see strategy.py); None prompts with input()
+            verbose: Print cards and results; turn off for bots
+            stream: Use protocol v2: send the strategy as a standing policy and let the
+                server play every round, streaming back only the packets
+            sessions: Sessions to play back to back over one connection; more than one
+                needs a server running with keep-alive
+            offer_groups: Multicast groups to listen on for offers, besides broadcasts
+        """
+        if stream and strategy is None:
+            raise ValueError("streamed sessions need a strategy to send as the policy")
         self.team_name = "TeamPlayer"  # TODO: Change to your creative team name!
         self.udp_port = UDP_PORT
+        self.offer_groups = tuple(offer_groups)
         self.num_rounds = num_rounds if num_rounds is not None else 1
+        self.strategy = strategy
+        self.verbose = verbose
+        self.stream = stream
+        self.sessions = sessions
         self.wins = 0
         self.losses = 0
         self.ties = 0
+
+    def log(self, *args):
+        if self.verbose:
+            print(*args)
         
-    def start(self):
-        print("Client started, listening for offer requests...") # [cite: 75]
+    def start(self, offers=None):
+        """
+        Find a server and play one session.
+
+        Args:
+            offers: OfferCache kept live by a discovery.OfferListener (shareable by a
+                fleet of clients); connect at once to its least-loaded server
+                instead of waiting for the next broadcast
+        """
+        if offers is not None:
+            offer = offers.pick()
+            self.log(f"Using cached offer from {offer.ip} ({offer.name}), attempting to connect...")
+            self.connect_to_server(offer.ip, offer.port)
+            return
+
+        self.log("Client started, listening for offer requests...") # [cite: 75]
         
-        # UDP Listener setup
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        # Enable port reuse to allow multiple clients on same machine.
-        # SO_REUSEPORT is not available on Windows, so fall back to SO_REUSEADDR.
-        reuse_opt = getattr(socket, "SO_REUSEPORT", socket.SO_REUSEADDR)
-        sock.setsockopt(socket.SOL_SOCKET, reuse_opt, 1)
-        sock.bind(('', self.udp_port))
+        # Only needed when discovering; clients given a server address skip the import
+        from discovery import open_offer_socket, parse_offer, request_offers
+
+        # UDP Listener setup; ask for offers now rather than waiting for the next broadcast
+        sock = open_offer_socket(self.udp_port, self.offer_groups)
+        request_offers(sock, ('<broadcast>',) + self.offer_groups)
 
         try:
             while True:
                 data, addr = sock.recvfrom(BUFFER_SIZE)
-                try:
-                    # Unpack Offer: Cookie(4), Type(1), Port(2), Name(32) [cite: 85-90]
-                    cookie, msg_type, server_port, server_name = struct.unpack('!IBH32s', data)
-                    
-                    if cookie != MAGIC_COOKIE or msg_type != MSG_TYPE_OFFER:
-                        continue
-                    
-                    server_ip = addr[0]
-                    server_name = server_name.decode('utf-8').strip('\x00')
-                    print(f"Received offer from {server_ip}, attempting to connect...") # [cite: 76]
-                    
-                    self.connect_to_server(server_ip, server_port)
-                    break # After one session, logic resets 
-
-                except Exception as e:
-                    print(f"Error parsing UDP: {e}")
+                # Offer: Cookie(4), Type(1), Port(2), Name(32) [cite: 85-90], load hints are optional
+                offer = parse_offer(data, addr)
+                if offer is None:
+                    continue
+
+                self.log(f"Received offer from {offer.ip}, attempting to connect...") # [cite: 76]
+                self.connect_to_server(offer.ip, offer.port)
+                break # After one session, logic resets 
         finally:
             sock.close()
-            print("UDP socket closed.")
+            self.log("UDP socket closed.")
 
     def connect_to_server(self, ip, port):
         tcp_sock = None
         try:
             tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             tcp_sock.connect((ip, port))
-            
-            # Send Request: Cookie(4), Type(1), Rounds(1), Name(32) [cite: 91-95]
-            rounds = self.num_rounds
-            packet = struct.pack('!IBB32s', 
-                                 MAGIC_COOKIE, 
-                                 MSG_TYPE_REQUEST, 
-                                 rounds, 
-                                 self.team_name.encode('utf-8').ljust(32, b'\x00'))
-            tcp_sock.sendall(packet)
-            
-            # Start game loop 
-            self.handle_gameplay(tcp_sock)
+
+            # Kept for every session on this connection; streamed sessions arrive in large bursts
+            recv_buffer = RecvBuffer(BUFFER_SIZE * 64 if self.stream else BUFFER_SIZE * 4)
+            for session in range(self.sessions):
+                if not self.play_session(tcp_sock, recv_buffer):
+                    return
+
+            # Print final statistics
+            self.log_summary()
             
         except Exception as e:
-            print(f"Connection failed: {e}")
+            self.log(f"Connection failed: {e}")
         finally:
             if tcp_sock is not None:
                 tcp_sock.close()
 
+    def play_session(self, conn, recv_buffer):
+        """
+        Send one request and play it out.
+
+        Returns:
+            bool: True if every round finished
+        """
+        rounds = self.num_rounds
+        team_name = self.team_name.encode('utf-8').ljust(32, b'\x00')
+        if self.stream:
+            # v2 Request: Cookie(4), Type(1), Rounds(4), Name(32), Hard policy(10), Soft policy(10)
+            hard, soft = hit_below_policy(self.strategy)
+            conn.sendall(REQUEST_V2_STRUCT.pack(MAGIC_COOKIE, MSG_TYPE_REQUEST_V2,
+                                                rounds, team_name, hard, soft))
+            return self.handle_stream(conn, recv_buffer)
+
+        # Send Request: Cookie(4), Type(1), Rounds(1), Name(32) [cite: 91-95]
+        packet = REQUEST_STRUCT.pack(MAGIC_COOKIE, 
+                                     MSG_TYPE_REQUEST, 
+                                     rounds, 
+                                     team_name)
+        conn.sendall(packet)
+        
+        # Start game loop 
+        return self.handle_gameplay(conn, recv_buffer)
+
     def decode_card_from_network(self, rank, suit):
         """
         Convert rank + suit from network to game value and display string.
@@ -80,26 +139,62 @@ class BlackjackClient:
         Returns:
             tuple: (card_value, display_string)
         """
-        # Convert rank to game value
-        if rank == RANK_ACE:  # Ace
-            card_value = CARD_VALUE_ACE  # 11 (can be adjusted in hand_value)
-            rank_str = "A"
-        elif rank >= RANK_JACK:  # J, Q, K (11, 12, 13)
-            card_value = 10
-            rank_str = {RANK_JACK: "J", RANK_QUEEN: "Q", RANK_KING: "K"}.get(rank, str(rank))
-        else:  # 2-10
-            card_value = rank
-            rank_str = str(rank)
-        
-        # Get suit symbol
-        suit_symbol = SUIT_SYMBOLS[suit] if 0 <= suit <= 3 else "?"
-        
-        display_string = f"{rank_str}{suit_symbol}"
-        return card_value, display_string
+        # Precomputed value and display tables shared with the server
+        return decode_card(rank, suit)
+
+    def handle_stream(self, conn, recv_buffer):
+        """
+        Count the results of a v2 session; the server plays every round itself.
+
+        Returns:
+            bool: True if every round finished
+        """
+        rounds_left = self.num_rounds
+        while rounds_left > 0:
+            try:
+                if not recv_buffer.fill(conn):
+                    self.log("Server closed connection during gameplay.")
+                    return False
+            except Exception as e:
+                self.log(f"Connection error: {e}")
+                return False
+
+            for cookie, msg_type, status, card_rank, card_suit in recv_buffer.packets(PAYLOAD_STRUCT):
+                if cookie != MAGIC_COOKIE or msg_type != MSG_TYPE_PAYLOAD:
+                    self.log("Warning: Invalid payload packet received")
+                    continue
+                if status == RESULT_WIN:
+                    self.wins += 1
+                elif status == RESULT_LOSS:
+                    self.losses += 1
+                elif status == RESULT_TIE:
+                    self.ties += 1
+                else:
+                    continue  # Card packet
+                rounds_left -= 1
+        return True
 
-    def handle_gameplay(self, conn):
+    def log_summary(self):
+        if not self.verbose:
+            return
+        played = self.wins + self.losses + self.ties
+        self.log(f"\n{'='*50}")
+        self.log(f"Finished playing {played} rounds!")
+        self.log(self.summary())
+        if played > 0:
+            win_rate = (self.wins / played) * 100
+            self.log(f"Win rate: {win_rate:.1f}%")
+        self.log(f"{'='*50}")
+
+    def summary(self):
+        return f"Wins: {self.wins}, Losses: {self.losses}, Ties: {self.ties}"
+
+    def handle_gameplay(self, conn, recv_buffer=None):
         """
         Handles the TCP communication during the game.
+
+        Returns:
+            bool: True if every round finished
         """
         def _encode_decision(decision: str) -> bytes:
             """
@@ -107,29 +202,27 @@ class BlackjackClient:
             Format: Cookie(4) + Type(1) + Decision(5) = 10 bytes
             """
             decision_bytes = decision.encode('utf-8')[:5].ljust(5, b'\x00')
-            packet = struct.pack('!IB5s', MAGIC_COOKIE, MSG_TYPE_PAYLOAD, decision_bytes)
+            packet = DECISION_STRUCT.pack(MAGIC_COOKIE, MSG_TYPE_PAYLOAD, decision_bytes)
             return packet
 
-        def hand_value(cards):
-            total = sum(cards)
-            aces = cards.count(CARD_VALUE_ACE)
-            while total > 21 and aces > 0:
-                total -= 10
-                aces -= 1
-            return total
-
         round_index = 1
         rounds_left = self.num_rounds
+        # Card and result text is only formatted when it will be printed
+        verbose = self.verbose
         
-        # Initialize a buffer to hold incoming data across recv calls
-        data_buffer = b""
+        # Preallocated buffer holding incoming data across recv calls
+        if recv_buffer is None:
+            recv_buffer = RecvBuffer()
 
         while rounds_left > 0:
-            print(f"\n=== Round {round_index} ===")
+            if verbose:
+                self.log(f"\n=== Round {round_index} ===")
 
             player_cards = []
+            player_hand = HandState()
             player_card_displays = []  # For display purposes
             dealer_cards = []
+            dealer_hand = HandState()
             dealer_card_displays = []  # For display purposes
             player_sum = None
             dealer_sum = None
@@ -144,43 +237,31 @@ class BlackjackClient:
             while not round_over:
                 # Only receive if we don't have a full packet in the buffer
                 # Server sends 9-byte packets now
-                if len(data_buffer) < 9:
+                if len(recv_buffer) < PAYLOAD_STRUCT.size:
                     try:
-                        data = conn.recv(BUFFER_SIZE)
-                        if not data:
-                            print("Server closed connection during gameplay.")
-                            return
-                        data_buffer += data
+                        if not recv_buffer.fill(conn):
+                            self.log("Server closed connection during gameplay.")
+                            return False
                     except Exception as e:
-                        print(f"Connection error: {e}")
-                        return
+                        self.log(f"Connection error: {e}")
+                        return False
 
                 # Process ALL complete packets currently in the buffer
-                while len(data_buffer) >= 9:
-                    # Slice off the first 9 bytes
-                    packet = data_buffer[:9]
-                    data_buffer = data_buffer[9:] # Keep the remaining bytes!
-
+                # Unpack: Cookie(4) + Type(1) + Status(1) + Rank(2) + Suit(1) = 9 bytes
+                for cookie, msg_type, status, card_rank, card_suit in recv_buffer.packets(PAYLOAD_STRUCT):
                     try:
-                        # Unpack: Cookie(4) + Type(1) + Status(1) + Rank(2) + Suit(1) = 9 bytes
-                        cookie, msg_type, status, card_rank, card_suit = struct.unpack('!IBBHB', packet)
-
                         if cookie != MAGIC_COOKIE:
-                            print(f"Warning: Invalid magic cookie received: {hex(cookie)}")
+                            self.log(f"Warning: Invalid magic cookie received: {hex(cookie)}")
                             continue
                         
                         if msg_type != MSG_TYPE_PAYLOAD:
-                            print(f"Warning: Invalid message type received: {hex(msg_type)}")
+                            self.log(f"Warning: Invalid message type received: {hex(msg_type)}")
                             continue
 
                         # Check result
                         if status in (RESULT_WIN, RESULT_LOSS, RESULT_TIE):
-                            outcome = {
-                                RESULT_WIN: "You win! 🎉",
-                                RESULT_LOSS: "You lose.",
-                                RESULT_TIE: "Tie.",
-                            }.get(status, f"Finished with status {status}")
-                            print(f"\nResult for round {round_index}: {outcome}")
+                            if verbose:
+                                self.log(f"\nResult for round {round_index}: {OUTCOME_MESSAGES[status]}")
                             
                             # Update statistics
                             if status == RESULT_WIN:
@@ -195,7 +276,7 @@ class BlackjackClient:
                             round_over = True # Signal to exit the outer loop
                             break # Break the processing loop
 
-                        # Decode card from rank + suit
+                        # Decode card from rank + suit (table lookups; display strings are precomputed)
                         card_value, card_display = self.decode_card_from_network(card_rank, card_suit)
 
                         # Logic to determine whose card it is
@@ -204,14 +285,14 @@ class BlackjackClient:
                             # First 2 packets are player's initial cards
                             player_cards.append(card_value)
                             player_card_displays.append(card_display)
-                            player_sum = hand_value(player_cards)
+                            player_sum = player_hand.add(card_value)
                             initial_packets += 1
                             role = "player"
                         elif initial_packets == 2:
                             # Third packet is dealer's visible card
                             dealer_cards.append(card_value)
                             dealer_card_displays.append(card_display)
-                            dealer_sum = hand_value(dealer_cards)
+                            dealer_sum = dealer_hand.add(card_value)
                             initial_packets += 1
                             role = "dealer"
                         else:
@@ -219,26 +300,27 @@ class BlackjackClient:
                             if not player_done and waiting_for_player_card:
                                 player_cards.append(card_value)
                                 player_card_displays.append(card_display)
-                                player_sum = hand_value(player_cards)
+                                player_sum = player_hand.add(card_value)
                                 waiting_for_player_card = False
                                 role = "player"
                             else:
                                 dealer_cards.append(card_value)
                                 dealer_card_displays.append(card_display)
-                                dealer_sum = hand_value(dealer_cards)
+                                dealer_sum = dealer_hand.add(card_value)
                                 role = "dealer"
 
                         # Display the card
-                        if role == "player":
+                        if verbose and role == "player":
                             cards_str = ', '.join(player_card_displays)
-                            print(f"Your cards: [{cards_str}], last card: {card_display}, sum: {player_sum}")
-                        elif role == "dealer":
+                            self.log(f"Your cards: [{cards_str}], last card: {card_display}, sum: {player_sum}")
+                        elif verbose and role == "dealer":
                             cards_str = ', '.join(dealer_card_displays)
-                            print(f"Dealer cards: [{cards_str}], last card: {card_display}, dealer sum: {dealer_sum}")
+                            self.log(f"Dealer cards: [{cards_str}], last card: {card_display}, dealer sum: {dealer_sum}")
 
                         # Check for bust
                         if role == "player" and player_sum is not None and player_sum > 21:
-                            print("💥 Busted (sum > 21)! Waiting for server result...")
+                            if verbose:
+                                self.log("💥 Busted (sum > 21)! Waiting for server result...")
                             player_done = True
                             waiting_for_player_card = False
                             continue
@@ -252,7 +334,11 @@ class BlackjackClient:
                             and player_sum <= 21
                             and len(player_cards) >= 2
                         ):
-                            decision = input("Hit or Stand? [h/s]: ").strip().lower()
+                            if self.strategy is None:
+                                decision = input("Hit or Stand? [h/s]: ").strip().lower()
+                            else:
+                                hit = self.strategy(player_sum, player_hand.soft, dealer_cards[0])
+                                decision = 'h' if hit else 's'
                             if decision.startswith('h'):
                                 payload = _encode_decision("Hittt")
                                 waiting_for_player_card = True
@@ -264,25 +350,71 @@ class BlackjackClient:
                             conn.sendall(payload)
 
                     except Exception as e:
-                        print(f"Error handling gameplay payload: {e}")
+                        self.log(f"Error handling gameplay payload: {e}")
 
-        # Print final statistics
-        print(f"\n{'='*50}")
-        print(f"Finished playing {self.num_rounds} rounds!")
-        print(f"Wins: {self.wins}, Losses: {self.losses}, Ties: {self.ties}")
-        if self.num_rounds > 0:
-            win_rate = (self.wins / self.num_rounds) * 100
-            print(f"Win rate: {win_rate:.1f}%")
-        print(f"{'='*50}")
+        return True
 
 if __name__ == "__main__":
-    # Get number of rounds from user (default to 1 if invalid)
-    try:
-        rounds_input = input("Enter number of rounds (default 1): ").strip()
-        num_rounds = int(rounds_input) if rounds_input else 1
-        num_rounds = max(1, min(num_rounds, 255))  # Clamp between 1 and 255 (max for 1 byte)
-    except ValueError:
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Blackijecky client")
+    parser.add_argument("-n", "--rounds", type=int, default=None,
+                        help="rounds per session (default: ask on a terminal, else 1)")
+    parser.add_argument("--strategy", choices=sorted(STRATEGIES), default=None,
+                        help="play headless with this strategy (default: ask for every decision "
+                             "on a terminal, else optimal)")
+    parser.add_argument("--server", metavar="HOST:PORT", default=None,
+                        help="connect straight to this server instead of waiting for an offer")
+    parser.add_argument("--multicast", action="append", default=[], metavar="GROUP",
+                        help="also listen for offers sent to this multicast group (repeatable)")
+    parser.add_argument("--stream", action="store_true",
+                        help="use protocol v2: the server plays the strategy, no per-decision round trips")
+    parser.add_argument("--sessions", type=int, default=1,
+                        help="sessions over one connection (server needs --keep-alive)")
+    parser.add_argument("--output", choices=["full", "summary", "quiet"], default=None,
+                        help="full: every card; summary: one result line; quiet: exit status only "
+                             "(default: full on a terminal, else summary)")
+    args = parser.parse_args()
+
+    # Prompts and card-by-card display are only for a person at a terminal
+    interactive = sys.stdin.isatty()
+    output = args.output or ("full" if sys.stdout.isatty() else "summary")
+
+    num_rounds = args.rounds
+    if num_rounds is None and interactive and args.strategy is None and not args.stream:
+        # Get number of rounds from user (default to 1 if invalid)
+        try:
+            rounds_input = input("Enter number of rounds (default 1): ").strip()
+            num_rounds = int(rounds_input) if rounds_input else 1
+            num_rounds = max(1, min(num_rounds, 255))  # Clamp between 1 and 255 (max for 1 byte)
+        except ValueError:
+            num_rounds = 1
+    elif num_rounds is None:
         num_rounds = 1
-    
-    client = BlackjackClient(num_rounds=num_rounds)
-    client.start()
\ No newline at end of file
+    max_rounds = 2**32 - 1 if args.stream else 255  # Rounds field: 4 bytes in v2, 1 byte in v1
+    if not 1 <= num_rounds <= max_rounds:
+        parser.error(f"--rounds must be between 1 and {max_rounds}")
+
+    if args.strategy is not None:
+        strategy = STRATEGIES[args.strategy]
+    elif interactive and not args.stream:
+        strategy = None  # Ask with input()
+    else:
+        strategy = STRATEGIES['optimal']
+
+    client = BlackjackClient(num_rounds=num_rounds, strategy=strategy, verbose=(output == "full"),
+                             stream=args.stream, sessions=args.sessions, offer_groups=args.multicast)
+    if args.server is not None:
+        host, _, port = args.server.rpartition(':')
+        if not host or not port.isdigit():
+            parser.error("--server must be HOST:PORT")
+        client.connect_to_server(host, int(port))
+    else:
+        client.start()
+
+    if output == "summary":
+        print(client.summary())
+    # Non-zero if the connection failed or ended before every round was played
+    played = client.wins + client.losses + client.ties
+    sys.exit(0 if played == num_rounds * args.sessions else 1)
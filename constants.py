@@ -4,6 +4,7 @@ Constants and protocol definitions for Blackijecky.
 
 # Networking Constants
 UDP_PORT = 13122  # Listening port for UDP offers 
+DISCOVERY_PORT = 13123  # Servers listen here for discover requests and answer with an offer
 MAGIC_COOKIE = 0xabcddcba  # [cite: 87]
 BUFFER_SIZE = 1024
 
@@ -11,6 +12,8 @@ BUFFER_SIZE = 1024
 MSG_TYPE_OFFER = 0x2    # [cite: 88]
 MSG_TYPE_REQUEST = 0x3  # [cite: 93]
 MSG_TYPE_PAYLOAD = 0x4  # [cite: 99]
+MSG_TYPE_REQUEST_V2 = 0x5  # Streamed session: 32-bit rounds + standing policy, no decisions
+MSG_TYPE_DISCOVER = 0x6   # Client -> DISCOVERY_PORT: send me an offer now
 
 # Game Results (Server -> Client)
 RESULT_WIN = 0x3    # [cite: 101]
@@ -0,0 +1,276 @@
+"""
+Precomputed hit/stand table for headless Blackijecky players.
+
+The table holds one decision for every player total (0-21), hard or soft,
+against every dealer up-card (2-11). It is derived by exact combinatorial
+EV under the server's default rules: a fresh 52-card deck every round, the
+dealer's hole card drawn from the same deck, the dealer stands on all 17s,
+no doubles or splits, and even-money payouts.
+
+For every up-card, the generator enumerates every player hand composition.
+For each one it computes the exact stand EV from the dealer's final-total
+distribution, given the cards left in the deck. It then computes the hit EV
+with optimal play afterwards. A table entry hits when the hit-minus-stand
+EV, weighted by the probability of holding each composition, is positive.
+
+The result ships as decision_table.bin, a small header plus one byte per
+entry. DecisionTable memory-maps it, and a lookup is a single index.
+Regenerating it needs NumPy (python decision_table.py --build); reading it
+does not.
+"""
+import mmap
+import os
+import struct
+from constants import *
+
+TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'decision_table.bin')
+TABLE_MAGIC = b'BJDT'
+TABLE_VERSION = 1
+TOTALS = 22   # Player totals 0-21
+UP_COUNT = 10  # Dealer up-cards 2-11, indexed dealer_up - 2 like strategy.UP_CARDS
+TABLE_HEADER_STRUCT = struct.Struct('!4sHBBB')  # Magic(4), Version(2), Kinds(1), Totals(1), Up-cards(1)
+TABLE_SIZE = 2 * TOTALS * UP_COUNT             # Entries [soft][total][dealer_up - 2], 1 = hit
+
+# Card values by index for the generator: index 0 is the Ace (1, or 11 when soft), 9 is any ten-value card
+DECK_COUNTS = (4, 4, 4, 4, 4, 4, 4, 4, 4, 16)
+DEALER_STAND = 17
+DEALER_OUTCOMES = 6  # Final totals 17-21, then bust
+
+
+class DecisionTable:
+    """
+    Memory-mapped decision table, usable as a strategy callable (see strategy.py).
+    """
+
+    def __init__(self, path=TABLE_PATH):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        expected = TABLE_HEADER_STRUCT.pack(TABLE_MAGIC, TABLE_VERSION, 2, TOTALS, UP_COUNT)
+        if (len(self._map) != TABLE_HEADER_STRUCT.size + TABLE_SIZE
+                or self._map[:TABLE_HEADER_STRUCT.size] != expected):
+            self._map.close()
+            raise ValueError(f"{path} is not a version {TABLE_VERSION} decision table")
+        self._entries = memoryview(self._map)[TABLE_HEADER_STRUCT.size:]
+
+    def __call__(self, player_sum, soft, dealer_up):
+        """True to hit. player_sum must be 0-21 and dealer_up 2-11."""
+        return self._entries[(soft * TOTALS + player_sum) * UP_COUNT + dealer_up - 2] == 1
+
+    def close(self):
+        self._entries.release()
+        self._map.close()
+
+
+def hand_total(hard, has_ace):
+    """Best total of a hand from its all-Aces-as-1 sum, and whether that total is soft."""
+    if has_ace and hard + 10 <= 21:
+        return hard + 10, True
+    return hard, False
+
+
+def dealer_draws(up, limits):
+    """
+    Every multiset of cards the dealer can draw after its up-card before standing or busting.
+
+    Args:
+        up: Up-card index into DECK_COUNTS
+        limits: Most cards of each value left in the deck
+
+    Returns:
+        dict: counts tuple -> [number of draw orders that reach it, outcome index]
+    """
+    draws = {}
+    counts = [0] * len(limits)
+
+    def draw(hard, has_ace):
+        for card in range(len(limits)):
+            if counts[card] == limits[card]:
+                continue
+            counts[card] += 1
+            card_hard, card_ace = hard + card + 1, has_ace or card == 0
+            total, _ = hand_total(card_hard, card_ace)
+            if total >= DEALER_STAND:
+                outcome = total - DEALER_STAND if total <= 21 else DEALER_OUTCOMES - 1
+                draws.setdefault(tuple(counts), [0, outcome])[0] += 1
+            else:
+                draw(card_hard, card_ace)
+            counts[card] -= 1
+
+    draw(up + 1, up == 0)
+    return draws
+
+
+def dealer_outcomes(np, draws, decks, batch_size=128):
+    """
+    Exact distribution of the dealer's final total for each remaining deck.
+
+    Every order of drawing the same multiset has the same probability: the
+    falling factorials of the counts drawn over the falling factorial of the
+    deck size. The distribution is therefore one weighted sum over the
+    multisets from dealer_draws.
+
+    Args:
+        decks: (n, 10) array of cards left per value, hole card still in the deck
+
+    Returns:
+        (n, DEALER_OUTCOMES) array of probabilities
+    """
+    multisets = np.array(list(draws), dtype=np.int64)
+    orders = np.array([order for order, _ in draws.values()], dtype=np.float64)
+    sizes = multisets.sum(axis=1)
+    one_hot = np.eye(DEALER_OUTCOMES)[[outcome for _, outcome in draws.values()]]
+    depth = int(multisets.max()) + 1
+    columns = np.arange(decks.shape[1])[None, :]
+
+    results = []
+    for start in range(0, len(decks), batch_size):
+        batch = decks[start:start + batch_size].astype(np.float64)
+        # falling[b, v, j] = batch[b, v] * (batch[b, v] - 1) * ... (j factors), 0 once it runs out
+        factors = np.clip(batch[:, :, None] - np.arange(depth - 1), 0, None)
+        falling = np.concatenate((np.ones(batch.shape + (1,)), np.cumprod(factors, axis=2)), axis=2)
+        numerators = falling[:, columns, multisets].prod(axis=2) * orders
+        remaining = batch.sum(axis=1)
+        size_factors = np.clip(remaining[:, None] - np.arange(sizes.max()), 0, None)
+        denominators = np.concatenate((np.ones((len(batch), 1)), np.cumprod(size_factors, axis=1)), axis=1)
+        results.append((numerators / denominators[:, sizes]) @ one_hot)
+    return np.concatenate(results)
+
+
+def player_hands(limits):
+    """Every multiset of two or more player cards whose all-Aces-as-1 sum is at most 21."""
+    hands = []
+    counts = []
+
+    def choose(card, hard):
+        if card == len(limits):
+            if sum(counts) >= 2:
+                hands.append(tuple(counts))
+            return
+        taken = 0
+        while taken <= limits[card] and hard + taken * (card + 1) <= 21:
+            counts.append(taken)
+            choose(card + 1, hard + taken * (card + 1))
+            counts.pop()
+            taken += 1
+
+    choose(0, 0)
+    return hands
+
+
+def build_up_card(np, up):
+    """
+    Summed, reach-weighted hit-minus-stand EV for one dealer up-card.
+
+    Returns:
+        (2, TOTALS) array: positive entries favour hitting; NaN where no hand reaches the total
+    """
+    deck = list(DECK_COUNTS)
+    deck[up] -= 1
+    hands = player_hands(deck)
+    index = {hand: i for i, hand in enumerate(hands)}
+    remaining = np.array(deck)[None, :] - np.array(hands)
+    outcomes = dealer_outcomes(np, dealer_draws(up, deck), remaining)
+
+    hard = [sum(count * (card + 1) for card, count in enumerate(hand)) for hand in hands]
+    totals = [hand_total(hard[i], hand[0] > 0) for i, hand in enumerate(hands)]
+    stand = []
+    for (total, _), dist in zip(totals, outcomes):
+        # dist: P(dealer ends on 17..21), then P(bust)
+        won = dist[DEALER_OUTCOMES - 1] + sum(dist[:max(total - DEALER_STAND, 0)])
+        lost = sum(dist[max(total - DEALER_STAND + 1, 0):DEALER_OUTCOMES - 1])
+        stand.append(won - lost)
+
+    def next_hands(i):
+        """(probability, index of the hand after hitting, or None on a bust) per card value."""
+        left = remaining[i]
+        cards = left.sum()
+        for card in range(len(deck)):
+            if left[card]:
+                after = list(hands[i])
+                after[card] += 1
+                yield left[card] / cards, (index[tuple(after)] if hard[i] + card + 1 <= 21 else None)
+
+    # Hit EV with optimal play afterwards, from the largest hands down
+    order = sorted(range(len(hands)), key=lambda i: hard[i], reverse=True)
+    hit = [0.0] * len(hands)
+    best = [0.0] * len(hands)
+    for i in order:
+        hit[i] = sum(p * (-1.0 if j is None else best[j]) for p, j in next_hands(i))
+        best[i] = max(hit[i], stand[i])
+
+    # Probability of holding each hand at a decision, playing optimally from the first two cards
+    cards = sum(deck)
+    reach = [0.0] * len(hands)
+    for i, hand in enumerate(hands):
+        if sum(hand) == 2:
+            pair = [card for card in range(len(deck)) for _ in range(hand[card])]
+            a, b = pair
+            ways = deck[a] * (deck[b] - (a == b)) * (1 if a == b else 2)
+            reach[i] = ways / (cards * (cards - 1))
+    for i in reversed(order):
+        if reach[i] and hit[i] > stand[i]:
+            for p, j in next_hands(i):
+                if j is not None:
+                    reach[j] += reach[i] * p
+
+    gain = np.zeros((2, TOTALS))
+    weight = np.zeros((2, TOTALS))
+    for i, (total, soft) in enumerate(totals):
+        gain[int(soft), total] += reach[i] * (hit[i] - stand[i])
+        weight[int(soft), total] += reach[i]
+    return np.where(weight > 0, gain, np.nan)
+
+
+def build_table():
+    """
+    Returns:
+        bytes: TABLE_SIZE entries, [soft][total][dealer_up - 2], 1 to hit
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        raise ImportError("building the decision table requires NumPy: pip install numpy") from None
+    table = bytearray(TABLE_SIZE)
+    for column, dealer_up in enumerate(range(2, CARD_VALUE_ACE + 1)):
+        gains = build_up_card(np, 0 if dealer_up == CARD_VALUE_ACE else dealer_up - 1)
+        for soft in (0, 1):
+            for total in range(TOTALS):
+                gain = gains[soft, total]
+                # Totals no hand can hold (hard 0-3, soft below 12): hit, as nothing can bust
+                hit = gain > 0 if not np.isnan(gain) else total < 12
+                table[(soft * TOTALS + total) * UP_COUNT + column] = int(hit)
+    return bytes(table)
+
+
+def write_table(path=TABLE_PATH):
+    with open(path, 'wb') as f:
+        f.write(TABLE_HEADER_STRUCT.pack(TABLE_MAGIC, TABLE_VERSION, 2, TOTALS, UP_COUNT))
+        f.write(build_table())
+
+
+def format_table(table):
+    """Lowest total each column stands on (H = always hit), hard and soft."""
+    lines = []
+    for soft, name in ((False, "hard"), (True, "soft")):
+        first = 12 if soft else 4
+        stands = [next((total for total in range(first, TOTALS) if not table(total, soft, up)), None)
+                  for up in range(2, CARD_VALUE_ACE + 1)]
+        lines.append(f"{name} stands from: " + " ".join(
+            f"{up if up < CARD_VALUE_ACE else 'A'}:{'H' if total is None else total}"
+            for up, total in zip(range(2, CARD_VALUE_ACE + 1), stands)))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Blackijecky precomputed decision table")
+    parser.add_argument("--build", action="store_true", help="recompute the table (needs NumPy) and write it")
+    parser.add_argument("--path", default=TABLE_PATH)
+    args = parser.parse_args()
+
+    if args.build:
+        write_table(args.path)
+    table = DecisionTable(args.path)
+    print(format_table(table))
+    table.close()
@@ -0,0 +1,155 @@
+"""
+Offer discovery for Blackijecky clients.
+
+Keeps a live cache of the servers heard on the offer port, keyed by
+address and expired after a TTL, so clients can connect as soon as a
+server is known instead of waiting for its next broadcast. Servers started
+with offer load hints report active sessions and free slots, and clients
+pick the least-loaded server. Clients also send a discover request when
+they start listening, so servers that answer them are heard at once rather
+than on their next tick.
+"""
+import socket
+import threading
+import time
+from collections import namedtuple
+from constants import *
+from protocol import OFFER_STRUCT, LOAD_HINT_STRUCT, LOAD_UNLIMITED, DISCOVER_PACKET
+
+DEFAULT_TTL = 3.0  # Seconds an offer stays live: three missed 1 Hz broadcasts
+
+# active and free are None for servers that send plain offers
+Offer = namedtuple('Offer', 'ip port name active free seen')
+
+
+def open_offer_socket(port=UDP_PORT, groups=()):
+    """
+    Args:
+        groups: Multicast groups to join, for servers that send offers to a group
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # Enable port reuse to allow multiple clients on same machine.
+    # SO_REUSEPORT is not available on Windows, so fall back to SO_REUSEADDR.
+    reuse_opt = getattr(socket, "SO_REUSEPORT", socket.SO_REUSEADDR)
+    sock.setsockopt(socket.SOL_SOCKET, reuse_opt, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)  # For request_offers
+    sock.bind(('', port))
+    for group in groups:
+        membership = socket.inet_aton(group) + socket.inet_aton('0.0.0.0')
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+    return sock
+
+
+def request_offers(sock, hosts=('<broadcast>',), port=DISCOVERY_PORT):
+    """
+    Ask servers for an offer now; their replies arrive on `sock` like any other offer.
+
+    Best effort: servers that ignore discover requests are still heard on their next tick.
+    """
+    for host in hosts:
+        try:
+            sock.sendto(DISCOVER_PACKET, (host, port))
+        except OSError:
+            pass
+
+
+def parse_offer(data, addr):
+    """
+    Decode an offer packet, with its load hints if the server appended them.
+
+    Returns:
+        Offer: or None if the packet is not a valid offer
+    """
+    if len(data) < OFFER_STRUCT.size:
+        return None
+    # Offer: Cookie(4), Type(1), Port(2), Name(32) [cite: 85-90], then optionally Active(2), Free(2)
+    cookie, msg_type, port, name = OFFER_STRUCT.unpack_from(data)
+    if cookie != MAGIC_COOKIE or msg_type != MSG_TYPE_OFFER:
+        return None
+    active = free = None
+    if len(data) >= OFFER_STRUCT.size + LOAD_HINT_STRUCT.size:
+        active, free = LOAD_HINT_STRUCT.unpack_from(data, OFFER_STRUCT.size)
+    name = name.decode('utf-8', errors='replace').strip('\x00')
+    return Offer(addr[0], port, name, active, free, time.monotonic())
+
+
+def load_key(offer):
+    """Sort key: servers with room first, then fewest active sessions (unknown last), then freshest."""
+    active = LOAD_UNLIMITED if offer.active is None else offer.active
+    return (offer.free == 0, active, -offer.seen)
+
+
+class OfferCache:
+    """Thread-safe map of (ip, port) -> latest Offer, expiring after `ttl` seconds."""
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self._offers = {}
+        self._changed = threading.Condition()
+
+    def add(self, offer):
+        with self._changed:
+            self._offers[(offer.ip, offer.port)] = offer
+            self._changed.notify_all()
+
+    def servers(self):
+        """Live offers, least loaded first; expired entries are dropped."""
+        now = time.monotonic()
+        with self._changed:
+            for key in [key for key, offer in self._offers.items() if now - offer.seen > self.ttl]:
+                del self._offers[key]
+            return sorted(self._offers.values(), key=load_key)
+
+    def best(self):
+        servers = self.servers()
+        return servers[0] if servers else None
+
+    def pick(self, timeout=None):
+        """
+        Claim the least-loaded live server, waiting up to `timeout` for one to be heard.
+
+        The claim counts the caller as one more active session on the cached
+        offer, so a fleet picking at once spreads out before the next broadcast.
+
+        Returns:
+            Offer: or None if no server was heard in time
+        """
+        with self._changed:
+            if not self._changed.wait_for(self.best, timeout):
+                return None
+            offer = self.best()
+            claimed = offer._replace(
+                active=None if offer.active is None else offer.active + 1,
+                free=offer.free if offer.free in (None, LOAD_UNLIMITED) else max(offer.free - 1, 0))
+            self._offers[(offer.ip, offer.port)] = claimed
+            return offer
+
+
+class OfferListener:
+    """Background thread that keeps an OfferCache fed from the UDP offer port."""
+
+    def __init__(self, cache=None, port=UDP_PORT, groups=()):
+        self.cache = cache if cache is not None else OfferCache()
+        self.sock = open_offer_socket(port, groups)
+        request_offers(self.sock, ('<broadcast>',) + tuple(groups))
+        self.sock.settimeout(0.5)  # Wake up periodically so close() is noticed
+        self.running = True
+        self.thread = threading.Thread(target=self._listen, daemon=True)
+        self.thread.start()
+
+    def _listen(self):
+        while self.running:
+            try:
+                data, addr = self.sock.recvfrom(BUFFER_SIZE)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            offer = parse_offer(data, addr)
+            if offer is not None:
+                self.cache.add(offer)
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.sock.close()
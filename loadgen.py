@@ -0,0 +1,248 @@
+"""
+Headless load generator for Blackijecky servers.
+
+Opens many concurrent bot sessions from one asyncio event loop, plays every
+decision with a strategy from strategy.py and reports throughput, the
+latency from sending a decision to receiving the server's response, and
+error counts. With stream=True the bots use protocol v2 instead: the
+strategy goes out once as a policy and only the streamed results are counted.
+"""
+import argparse
+import asyncio
+import collections
+import time
+from constants import *
+from protocol import REQUEST_STRUCT, REQUEST_V2_STRUCT, DECISION_STRUCT, PAYLOAD_STRUCT
+from scoring import CARD_VALUES, HandState
+from strategy import STRATEGIES, hit_below_policy
+from async_server import raise_nofile_limit
+
+MAX_ROUNDS_PER_SESSION = 255  # 1-byte rounds field in the request
+MAX_STREAM_ROUNDS = 2 ** 32 - 1  # 4-byte rounds field in the v2 request
+STREAM_READ_SIZE = 1 << 16
+
+HIT_PACKET = DECISION_STRUCT.pack(MAGIC_COOKIE, MSG_TYPE_PAYLOAD, b"Hittt")
+STAND_PACKET = DECISION_STRUCT.pack(MAGIC_COOKIE, MSG_TYPE_PAYLOAD, b"Stand")
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+class LoadStats:
+    def __init__(self):
+        self.rounds = 0
+        self.sessions = 0
+        self.results = collections.Counter()
+        self.errors = collections.Counter()
+        self.latencies = []  # Seconds from decision sent to first response packet
+
+    def report(self, elapsed):
+        latencies = sorted(self.latencies)
+        return {
+            'sessions': self.sessions,
+            'rounds': self.rounds,
+            'elapsed_s': elapsed,
+            'rounds_per_s': self.rounds / elapsed if elapsed > 0 else 0.0,
+            'decisions': len(latencies),
+            'latency_p50_ms': percentile(latencies, 0.50) * 1000,
+            'latency_p99_ms': percentile(latencies, 0.99) * 1000,
+            'wins': self.results[RESULT_WIN],
+            'losses': self.results[RESULT_LOSS],
+            'ties': self.results[RESULT_TIE],
+            'errors': dict(self.errors),
+        }
+
+
+async def play_session(reader, writer, rounds, strategy, stats, team_name=b"LoadBot"):
+    writer.write(REQUEST_STRUCT.pack(MAGIC_COOKIE, MSG_TYPE_REQUEST, rounds,
+                                     team_name.ljust(32, b'\x00')))
+    for _ in range(rounds):
+        player = HandState()
+        player_cards = 0
+        dealer_up = None
+        my_turn = True       # Cards after the initial deal are ours until we stand
+        sent_at = None       # When the last decision went out
+
+        while True:
+            packet = await reader.readexactly(PAYLOAD_STRUCT.size)
+            if sent_at is not None:
+                stats.latencies.append(time.perf_counter() - sent_at)
+                sent_at = None
+
+            cookie, msg_type, status, rank, suit = PAYLOAD_STRUCT.unpack(packet)
+            if cookie != MAGIC_COOKIE or msg_type != MSG_TYPE_PAYLOAD:
+                raise ValueError("bad payload packet")
+
+            if status != RESULT_CONTINUE:
+                stats.results[status] += 1
+                stats.rounds += 1
+                break
+
+            if player_cards < 2:
+                player.add(CARD_VALUES[rank])
+                player_cards += 1
+            elif dealer_up is None:
+                dealer_up = CARD_VALUES[rank]
+            elif my_turn:
+                player.add(CARD_VALUES[rank])
+            else:
+                continue  # Dealer reveal and hits
+
+            if dealer_up is None or not my_turn:
+                continue
+            if player.busted:
+                my_turn = False  # Busted, the server sends the loss next
+                continue
+
+            if strategy(player.total, player.soft, dealer_up):
+                writer.write(HIT_PACKET)
+            else:
+                writer.write(STAND_PACKET)
+                my_turn = False
+            sent_at = time.perf_counter()
+    stats.sessions += 1
+
+
+async def play_stream_session(reader, writer, rounds, policy, stats, team_name=b"LoadBot"):
+    """Protocol v2 session: send the (hard, soft) policy once, then count streamed results."""
+    writer.write(REQUEST_V2_STRUCT.pack(MAGIC_COOKIE, MSG_TYPE_REQUEST_V2, rounds,
+                                        team_name.ljust(32, b'\x00'), *policy))
+    pending = b''
+    while rounds > 0:
+        data = await reader.read(STREAM_READ_SIZE)
+        if not data:
+            raise asyncio.IncompleteReadError(pending, None)
+        pending += data
+        whole = len(pending) - len(pending) % PAYLOAD_STRUCT.size
+        for cookie, msg_type, status, rank, suit in PAYLOAD_STRUCT.iter_unpack(pending[:whole]):
+            if cookie != MAGIC_COOKIE or msg_type != MSG_TYPE_PAYLOAD:
+                raise ValueError("bad payload packet")
+            if status != RESULT_CONTINUE:
+                stats.results[status] += 1
+                stats.rounds += 1
+                rounds -= 1
+        pending = pending[whole:]
+    stats.sessions += 1
+
+
+async def run_bot(host, port, rounds, strategy, stats, timeout, stream=False, offers=None, keep_alive=False):
+    """
+    Play `rounds` rounds in as many back-to-back sessions as the protocol needs.
+
+    With an OfferCache, each new connection goes to the least-loaded server it
+    knows. With keep_alive, sessions after the first reuse the connection.
+    """
+    if stream:
+        policy = hit_below_policy(strategy)
+    writer = None
+    try:
+        while rounds > 0:
+            if offers is not None and writer is None:
+                offer = offers.pick(timeout=0)
+                if offer is not None:
+                    host, port = offer.ip, offer.port
+            if stream:
+                session_rounds = min(rounds, MAX_STREAM_ROUNDS)
+            else:
+                session_rounds = min(rounds, MAX_ROUNDS_PER_SESSION)
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+                if stream:
+                    session = play_stream_session(reader, writer, session_rounds, policy, stats)
+                else:
+                    session = play_session(reader, writer, session_rounds, strategy, stats)
+                await asyncio.wait_for(session, timeout)
+            except asyncio.TimeoutError:
+                stats.errors['timeout'] += 1
+                return
+            except asyncio.IncompleteReadError:
+                stats.errors['disconnected'] += 1
+                return
+            except ConnectionError as e:
+                stats.errors[type(e).__name__] += 1
+                return
+            except OSError as e:
+                stats.errors[f"OSError[{e.errno}]"] += 1
+                return
+            except ValueError:
+                stats.errors['protocol'] += 1
+                return
+            if not keep_alive:
+                writer.close()
+                writer = None
+            rounds -= session_rounds
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+async def run_load(host, port, clients, rounds, strategy, ramp=0.0, timeout=60.0, stream=False, offers=None,
+                   keep_alive=False):
+    """
+    Run `clients` concurrent bots against one server, or spread over discovered servers.
+
+    Args:
+        ramp: Seconds over which to spread the bots' start times
+        stream: Play protocol v2 sessions (no per-decision round trips)
+        offers: discovery.OfferCache to pick servers from; host and port are the fallback
+        keep_alive: Play each bot's sessions over one connection (server needs --keep-alive)
+
+    Returns:
+        dict: Throughput, latency percentiles and error counts (see LoadStats.report)
+    """
+    stats = LoadStats()
+
+    async def delayed(index):
+        if ramp:
+            await asyncio.sleep(ramp * index / clients)
+        await run_bot(host, port, rounds, strategy, stats, timeout, stream, offers, keep_alive)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(delayed(i) for i in range(clients)))
+    return stats.report(time.perf_counter() - start)
+
+
+def print_report(report):
+    print(f"Sessions: {report['sessions']}, Rounds: {report['rounds']} in {report['elapsed_s']:.2f}s "
+          f"({report['rounds_per_s']:.0f} rounds/s)")
+    print(f"Decision latency: p50 {report['latency_p50_ms']:.2f} ms, "
+          f"p99 {report['latency_p99_ms']:.2f} ms over {report['decisions']} decisions")
+    print(f"Wins: {report['wins']}, Losses: {report['losses']}, Ties: {report['ties']}")
+    errors = report['errors']
+    print(f"Errors: {sum(errors.values())}" + (f" {errors}" if errors else ""))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Blackijecky load generator")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12345)
+    parser.add_argument("--clients", type=int, default=1000, help="concurrent bot sessions")
+    parser.add_argument("--rounds", type=int, default=10, help="rounds each bot plays")
+    parser.add_argument("--strategy", choices=sorted(STRATEGIES), default="basic")
+    parser.add_argument("--ramp", type=float, default=0.0, help="seconds to spread connection starts over")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-session timeout in seconds")
+    parser.add_argument("--stream", action="store_true",
+                        help="use protocol v2: send the strategy as a policy, no per-decision round trips")
+    parser.add_argument("--keep-alive", action="store_true",
+                        help="reuse each bot's connection across sessions (server needs --keep-alive)")
+    parser.add_argument("--discover", type=float, default=None, metavar="SECONDS",
+                        help="listen for offers this long, then spread sessions over the least-loaded servers")
+    args = parser.parse_args()
+
+    offers = None
+    if args.discover is not None:
+        from discovery import OfferListener
+        listener = OfferListener()
+        time.sleep(args.discover)
+        offers = listener.cache
+        print(f"Discovered {len(offers.servers())} server(s)")
+
+    raise_nofile_limit()
+    print_report(asyncio.run(run_load(args.host, args.port, args.clients, args.rounds,
+                                      STRATEGIES[args.strategy], args.ramp, args.timeout, args.stream,
+                                      offers, args.keep_alive)))
@@ -0,0 +1,115 @@
+"""
+Lightweight counters, histograms and a text metrics endpoint shared by the
+Blackijecky server engines.
+"""
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds, from sub-millisecond server work to slow human decisions
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Counters:
+    """Thread-safe named integer counters."""
+
+    def __init__(self, *names):
+        self._lock = threading.Lock()
+        self._values = dict.fromkeys(names, 0)
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + amount
+
+    def get(self, name):
+        return self._values.get(name, 0)
+
+    def snapshot(self):
+        """Return a consistent copy of all counters as a dict."""
+        with self._lock:
+            return dict(self._values)
+
+
+class Histogram:
+    """Thread-safe fixed-bucket histogram; observe() is a bisect and two adds."""
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(self.bounds) + 1)  # Last bucket is +Inf
+        self._sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self):
+        """
+        Returns:
+            tuple: (per-bucket counts, sum of observed values)
+        """
+        with self._lock:
+            return list(self._counts), self._sum
+
+
+def render_metrics(prefix, counters, gauges=None, histograms=None):
+    """
+    Format metrics in the Prometheus text exposition format.
+
+    Args:
+        counters: dict of name -> monotonically increasing int
+        gauges: dict of name -> current value
+        histograms: dict of name -> Histogram
+    """
+    lines = []
+    for name, value in counters.items():
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        lines.append(f"{prefix}_{name}_total {value}")
+    for name, value in (gauges or {}).items():
+        lines.append(f"# TYPE {prefix}_{name} gauge")
+        lines.append(f"{prefix}_{name} {value:g}")
+    for name, histogram in (histograms or {}).items():
+        counts, total = histogram.snapshot()
+        lines.append(f"# TYPE {prefix}_{name} histogram")
+        cumulative = 0
+        for bound, count in zip(histogram.bounds, counts):
+            cumulative += count
+            lines.append(f'{prefix}_{name}_bucket{{le="{bound:g}"}} {cumulative}')
+        cumulative += counts[-1]
+        lines.append(f'{prefix}_{name}_bucket{{le="+Inf"}} {cumulative}')
+        lines.append(f"{prefix}_{name}_sum {total:.6f}")
+        lines.append(f"{prefix}_{name}_count {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def serve_metrics(render, port, host="127.0.0.1"):
+    """
+    Serve render() as plain text on http://host:port/metrics from a daemon thread.
+
+    Binds to localhost by default: the endpoint is for local scrapers and operators.
+
+    Returns:
+        ThreadingHTTPServer: call shutdown() to stop serving
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = render().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes are not game events
+
+    httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
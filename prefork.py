@@ -0,0 +1,149 @@
+"""
+Pre-fork mode for the Blackijecky server.
+
+A master process forks N workers. Each worker binds the TCP port with
+SO_REUSEPORT and runs its own BlackjackServer (threaded or asyncio), so the
+kernel spreads incoming players across cores instead of one GIL. Worker 0
+is the only process that broadcasts offers. Game counters are published by
+every worker into shared memory and summed by the master, which also serves
+them on the metrics endpoint (histograms stay per worker and are not exported).
+"""
+import multiprocessing
+import os
+import signal
+import threading
+from server import BlackjackServer, STAT_NAMES
+from metrics import render_metrics, serve_metrics
+
+PUBLISH_INTERVAL = 1.0  # Seconds between counter snapshots from each worker
+# Each worker's shared row: its counters, then its active_sessions gauge
+ROW_NAMES = STAT_NAMES + ('active_sessions',)
+
+
+def _worker_main(index, tcp_port, worker_mode, table_size, shared_stats, server_options):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if server_options.get('round_log'):
+        # Workers append to their own files; records from several processes would interleave
+        server_options = dict(server_options, round_log=f"{server_options['round_log']}.{index}")
+    if worker_mode == "async":
+        from async_server import AsyncBlackjackServer
+        server = AsyncBlackjackServer(tcp_port=tcp_port, reuse_port=True, table_size=table_size, **server_options)
+    else:
+        server = BlackjackServer(tcp_port=tcp_port, reuse_port=True, **server_options)
+
+    # Only the master's forwarded SIGTERM drains a worker. Ctrl-C reaches every process in the
+    # group, and acting on it too would make the master's SIGTERM look like a second signal
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
+
+    offset = index * len(ROW_NAMES)
+
+    def publish():
+        snapshot = server.stats.snapshot()
+        snapshot['active_sessions'] = server.active_sessions
+        for i, name in enumerate(ROW_NAMES):
+            shared_stats[offset + i] = snapshot[name]
+
+    stopped = threading.Event()
+
+    def publisher():
+        while not stopped.wait(PUBLISH_INTERVAL):
+            publish()
+
+    threading.Thread(target=publisher, daemon=True).start()
+    try:
+        # Exactly one process sends UDP offers
+        server.start(broadcast=(index == 0))
+    finally:
+        stopped.set()
+        publish()
+
+
+class PreforkServer:
+    def __init__(self, tcp_port=12345, workers=None, worker_mode="async", metrics_port=None, table_size=1,
+                 **server_options):
+        """
+        Args:
+            table_size: Seats per shared table in each async worker (see table.py)
+        """
+        if not hasattr(os, "fork"):
+            raise OSError("Pre-fork mode requires a platform with fork() and SO_REUSEPORT")
+        if table_size > 1 and worker_mode != "async":
+            raise ValueError("shared tables need async workers")
+        self.tcp_port = tcp_port
+        self.num_workers = workers or os.cpu_count() or 1
+        self.worker_mode = worker_mode
+        self.table_size = table_size
+        self.metrics_port = metrics_port
+        # Passed through to every worker's BlackjackServer
+        self.server_options = server_options
+        self.ctx = multiprocessing.get_context("fork")
+        # One row of ROW_NAMES values per worker; each row has a single writer
+        self.shared_stats = self.ctx.Array('q', self.num_workers * len(ROW_NAMES), lock=False)
+        self.workers = []
+        self.stopping = threading.Event()
+
+    def start(self):
+        print(f"Pre-fork master starting {self.num_workers} {self.worker_mode} workers on port {self.tcp_port}")
+        for index in range(self.num_workers):
+            worker = self.ctx.Process(target=_worker_main,
+                                      args=(index, self.tcp_port, self.worker_mode, self.table_size,
+                                            self.shared_stats, self.server_options),
+                                      name=f"blackjack-worker-{index}")
+            worker.start()
+            self.workers.append(worker)
+        if self.metrics_port is not None:
+            serve_metrics(self.render_metrics, self.metrics_port)
+
+        signal.signal(signal.SIGTERM, self.on_signal)
+        signal.signal(signal.SIGINT, self.on_signal)
+
+        # Wait for a shutdown signal or for every worker to exit on its own
+        while not self.stopping.wait(PUBLISH_INTERVAL):
+            if not any(worker.is_alive() for worker in self.workers):
+                break
+
+        self.stop()
+
+    def on_signal(self, signum, frame):
+        if self.stopping.is_set():
+            # Second signal: workers cut their sessions short after the current round
+            self.signal_workers()
+        self.stopping.set()
+
+    def signal_workers(self):
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.terminate()  # SIGTERM -> BlackjackServer.stop() in the worker
+
+    def stop(self):
+        """Ask every worker to drain (stop accepting, finish its sessions), wait, report totals."""
+        self.signal_workers()
+        for worker in self.workers:
+            worker.join()
+
+        totals = self.stats()
+        print(f"Pre-fork server stopped. Rounds: {totals['rounds']}, "
+              f"Wins: {totals['wins']}, Losses: {totals['losses']}, Ties: {totals['ties']}")
+        print(f"Evicted: idle {totals['evicted_idle']}, decision {totals['evicted_decision']}, "
+              f"session {totals['evicted_session']}, write {totals['evicted_write']}; "
+              f"rejected at capacity: {totals['rejected']}")
+        print(f"Drained {totals['drained']} sessions, {totals['evicted_drain']} stopped early "
+              f"at the drain deadline")
+
+    def render_metrics(self):
+        totals = self.stats()
+        gauges = {'workers_alive': sum(worker.is_alive() for worker in self.workers),
+                  'active_sessions': totals.pop('active_sessions')}
+        return render_metrics('blackjack', totals, gauges)
+
+    def stats(self):
+        """Aggregate the latest counters, and active sessions, published by all workers."""
+        totals = dict.fromkeys(ROW_NAMES, 0)
+        for index in range(self.num_workers):
+            offset = index * len(ROW_NAMES)
+            for i, name in enumerate(ROW_NAMES):
+                totals[name] += self.shared_stats[offset + i]
+            if index < len(self.workers) and not self.workers[index].is_alive():
+                # A worker that died without publishing again holds no sessions any more
+                totals['active_sessions'] -= self.shared_stats[offset + len(STAT_NAMES)]
+        return totals
@@ -0,0 +1,222 @@
+"""
+Precompiled packet layouts and buffers for the Blackijecky wire protocol.
+"""
+import socket
+import struct
+import time
+from constants import *
+
+# '!' = Network (Big Endian) for every message [cite: 85-101]
+OFFER_STRUCT = struct.Struct('!IBH32s')     # Cookie(4), Type(1), Port(2), Name(32)
+REQUEST_STRUCT = struct.Struct('!IBB32s')   # Cookie(4), Type(1), Rounds(1), Name(32)
+DECISION_STRUCT = struct.Struct('!IB5s')    # Cookie(4), Type(1), Decision(5)
+PAYLOAD_STRUCT = struct.Struct('!IBBHB')    # Cookie(4), Type(1), Result(1), Rank(2), Suit(1)
+
+# Optional offer trailer, only sent by servers started with offer load hints:
+# Active sessions(2), Free session slots(2) (LOAD_UNLIMITED without a session cap)
+LOAD_HINT_STRUCT = struct.Struct('!HH')
+LOAD_UNLIMITED = 0xFFFF
+
+# Discover request, client -> DISCOVERY_PORT: just the Cookie(4), Type(1) header.
+# Servers answer with their offer, sent straight back to the requesting address.
+DISCOVER_PACKET = struct.pack('!IB', MAGIC_COOKIE, MSG_TYPE_DISCOVER)
+
+# Protocol v2 request: Cookie(4), Type(1), Rounds(4), Name(32), then the standing
+# policy as "hit below N" thresholds against dealer up-cards 2-11, hard and soft (see strategy.py)
+POLICY_SIZE = 10
+REQUEST_V2_STRUCT = struct.Struct(f'!IBI32s{POLICY_SIZE}s{POLICY_SIZE}s')
+
+# Servers read the common Cookie(4), Type(1) header first, then the body for that request type
+HEADER_STRUCT = struct.Struct('!IB')
+REQUEST_BODIES = {
+    MSG_TYPE_REQUEST: struct.Struct('!B32s'),
+    MSG_TYPE_REQUEST_V2: struct.Struct(f'!I32s{POLICY_SIZE}s{POLICY_SIZE}s'),
+}
+
+
+class PayloadBatch:
+    """
+    Reusable outgoing buffer of server payload packets.
+
+    Packets are packed in place with pack_into and written out together, so a
+    burst such as the dealer's reveal and hits costs one send instead of one
+    tiny segment per card.
+    """
+
+    def __init__(self, capacity=16):
+        self.buffer = bytearray(PAYLOAD_STRUCT.size * capacity)
+        self.view = memoryview(self.buffer)
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def add(self, status, rank, suit):
+        end = self.length + PAYLOAD_STRUCT.size
+        if end > len(self.buffer):
+            # Grow by doubling; the old view must be released before the copy is replaced
+            self.view.release()
+            self.buffer = self.buffer + bytearray(len(self.buffer))
+            self.view = memoryview(self.buffer)
+        PAYLOAD_STRUCT.pack_into(self.buffer, self.length,
+                                 MAGIC_COOKIE, MSG_TYPE_PAYLOAD, status, rank, suit)
+        self.length = end
+
+    def take(self):
+        """Return the queued bytes (for transports that keep a reference) and reset."""
+        data = bytes(self.view[:self.length])
+        self.length = 0
+        return data
+
+    def move_to(self, queue):
+        """Append the queued bytes to a SendQueue and reset."""
+        queue.buffer += self.view[:self.length]
+        self.length = 0
+
+
+class SendQueue:
+    """
+    Outgoing bytes for one connection, written without parking in sendall.
+
+    send() writes only what the socket accepts right now. flush() then waits
+    for writability until at most `limit` bytes are left, within a timeout,
+    so a client that stops reading costs its session a timeout instead of
+    holding the writer inside a blocking send indefinitely.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def send(self, conn):
+        """Write as much as the socket takes without blocking."""
+        conn.settimeout(0)
+        try:
+            while self.buffer:
+                # Deleting from the front of a bytearray is O(1)
+                del self.buffer[:conn.send(self.buffer)]
+        except BlockingIOError:
+            pass
+
+    def flush(self, conn, limit=0, timeout=None):
+        """
+        Write until at most `limit` bytes remain queued.
+
+        Args:
+            timeout: Seconds allowed for the whole flush, None to wait forever
+
+        Raises:
+            socket.timeout: if more than `limit` bytes are still queued after `timeout`
+        """
+        self.send(conn)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while len(self.buffer) > limit:
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise socket.timeout("timed out")
+                conn.settimeout(remaining)
+            else:
+                conn.settimeout(None)
+            # With a timeout set, send() polls for writability first and may write part of the queue
+            del self.buffer[:conn.send(self.buffer)]
+
+
+class RecvBuffer:
+    """
+    Preallocated receive buffer filled with recv_into and decoded in place.
+
+    Frames are unpacked straight from the bytearray with unpack_from and a
+    read cursor, so back-to-back packets never cost a slice or a concatenation.
+    Unread bytes are moved to the front only when the write end reaches the
+    end of the buffer.
+    """
+
+    def __init__(self, size=BUFFER_SIZE * 4):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # Read cursor
+        self.end = 0    # Write cursor
+
+    def __len__(self):
+        return self.end - self.start
+
+    def fill(self, conn):
+        """
+        Receive whatever the socket has into the free space.
+
+        Returns:
+            int: Number of bytes received, 0 if the peer closed the connection
+        """
+        if self.end == len(self.buffer):
+            self._compact()
+        received = conn.recv_into(self.view[self.end:])
+        self.end += received
+        return received
+
+    def _compact(self):
+        unread = self.end - self.start
+        if self.start == 0:
+            # Full of unread data: grow; the old view must be released before the copy is replaced
+            self.view.release()
+            self.buffer = self.buffer + bytearray(len(self.buffer))
+            self.view = memoryview(self.buffer)
+            return
+        self.view[:unread] = self.view[self.start:self.end]
+        self.start = 0
+        self.end = unread
+
+    def unpack(self, layout):
+        """
+        Decode one frame of the given struct.Struct at the read cursor.
+
+        Returns:
+            tuple: Unpacked fields, or None if the frame is not complete yet
+        """
+        if self.end - self.start < layout.size:
+            return None
+        values = layout.unpack_from(self.buffer, self.start)
+        self.start += layout.size
+        if self.start == self.end:
+            # Drained: rewind for free instead of compacting later
+            self.start = self.end = 0
+        return values
+
+    def read(self, conn, layout, timeout=None):
+        """
+        Block until one whole frame is buffered, then decode it.
+
+        Bytes past the frame stay buffered for the next read, so a peer may
+        coalesce or pipeline frames and split them across segments freely.
+
+        Args:
+            timeout: Seconds allowed for the whole frame (not per recv), None to wait forever
+
+        Returns:
+            tuple: Unpacked fields, or None if the peer closed the connection first
+
+        Raises:
+            socket.timeout: if the frame is still incomplete after `timeout`
+        """
+        values = self.unpack(layout)
+        if values is not None:
+            return values
+        deadline = None if timeout is None else time.monotonic() + timeout
+        conn.settimeout(timeout)
+        while values is None:
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise socket.timeout("timed out")
+                conn.settimeout(remaining)
+            if not self.fill(conn):
+                return None
+            values = self.unpack(layout)
+        return values
+
+    def packets(self, layout):
+        """Yield every complete frame currently buffered, advancing the cursor as it goes."""
+        while self.end - self.start >= layout.size:
+            yield self.unpack(layout)
@@ -0,0 +1,90 @@
+"""
+Shuffle randomness for the server's shoes.
+
+Every thread gets its own generator (thread_rng), so concurrent sessions
+never share a generator state or wait on each other for one. Generators
+draw random words in bulk: one refill yields thousands of words, and a
+shuffle turns a slice of the buffer into all of its swap indices at once.
+An unseeded generator fills its buffer straight from os.urandom, so no
+pseudo-random output a player could model ever reaches a shoe; only
+seeded generators (reproducible tests and benchmarks) use random.Random.
+A forked child starts with no thread generators, so it never replays
+words its parent already buffered.
+"""
+import os
+import random
+import threading
+from array import array
+from itertools import repeat
+from operator import mul, rshift
+
+REFILL_WORDS = 1 << 12  # Random 64-bit words drawn per refill
+WORD_BITS = 64
+
+
+class ShuffleRNG:
+    """Generator for one thread or one table; not safe to share between threads."""
+
+    def __init__(self, seed=None, refill_words=REFILL_WORDS):
+        """
+        Args:
+            seed: Seed for a reproducible sequence; None draws every word from os.urandom
+            refill_words: Words drawn per refill
+        """
+        self.seeded = seed is not None
+        self.refill_words = refill_words
+        self._random = random.Random(seed) if self.seeded else None
+        self._words = array('Q')
+        self._position = 0
+        self._sizes = {}  # Sequence length -> range sizes n..2 of its swap indices
+
+    def _take(self, count):
+        """The next `count` buffered words, refilling the buffer in bulk when it runs out."""
+        if self._position + count > len(self._words):
+            size = 8 * max(count, self.refill_words)
+            self._words = array('Q', self._random.randbytes(size) if self.seeded else os.urandom(size))
+            self._position = 0
+        words = self._words[self._position:self._position + count]
+        self._position += count
+        return words
+
+    def shuffle(self, cards):
+        """
+        Fisher-Yates shuffle of a mutable sequence, in place.
+
+        Swap index i is (word * (i + 1)) >> 64 for one buffered 64-bit
+        word per card, computed for the whole shuffle at once. The
+        multiply-and-shift bias is below 2**-55 per index for shoes of up to
+        eight decks, far beneath anything a player could measure, so no
+        rejection loop is needed.
+        """
+        n = len(cards)
+        if n < 2:
+            return
+        sizes = self._sizes.get(n)
+        if sizes is None:
+            sizes = self._sizes[n] = list(range(n, 1, -1))
+        indices = map(rshift, map(mul, self._take(n - 1), sizes), repeat(WORD_BITS))
+        for i, j in zip(range(n - 1, 0, -1), indices):
+            cards[i], cards[j] = cards[j], cards[i]
+
+
+_local = threading.local()
+
+
+def _forget_thread_rngs():
+    # The child would otherwise deal from the same buffered words as its parent
+    global _local
+    _local = threading.local()
+
+
+if hasattr(os, 'register_at_fork'):  # Not available on Windows, which cannot fork
+    os.register_at_fork(after_in_child=_forget_thread_rngs)
+
+
+def thread_rng():
+    """The calling thread's generator, created on first use."""
+    rng = getattr(_local, 'rng', None)
+    if rng is None:
+        rng = _local.rng = ShuffleRNG()
+    return rng
@@ -0,0 +1,271 @@
+"""
+Append-only binary log of played rounds, for audits and replays.
+
+Every round is one fixed-size record: when it was played, the session and
+team, where the shoe stood, every card in the order play_round deals them
+(player's two, dealer's up-card and hole card, player hits, dealer hits),
+the player's decisions and the result. Shoes shuffle with words drawn
+from os.urandom (see rng.py), so the dealt cards themselves are logged,
+not a seed.
+
+Dealing threads and coroutines only pack a record into a memory buffer; a
+background thread writes the buffer to disk, so a slow disk never stalls a
+round. If the writer falls too far behind, records are dropped and counted
+rather than blocking the dealer.
+
+    python roundlog.py rounds.log               # replay and verify every round
+    python roundlog.py rounds.log --team Foo    # also print that team's rounds
+"""
+import argparse
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+from constants import *
+from scoring import HandState, CARD_ID_VALUES, DECK_CARDS, decode_card, encode_card, play_dealer, settle
+
+LOG_MAGIC = b'BJRL'
+LOG_VERSION = 1
+LOG_HEADER_STRUCT = struct.Struct('!4sHH')  # Magic(4), Version(2), Record size(2)
+
+# More cards than any single-deck round can use; longer rounds are dropped, not truncated
+MAX_ROUND_CARDS = 40
+# Time(8), Session(4), Team(32), Shuffles(4), Shoe position(4), Result(1),
+# Decisions(1), Cards dealt(1), Hit mask(4), Card ids(40)
+ROUND_RECORD_STRUCT = struct.Struct(f'!dI32sIIBBBI{MAX_ROUND_CARDS}s')
+RoundRecord = namedtuple('RoundRecord', 'time session team shuffles position result '
+                                        'decisions card_count hits cards')
+
+FLUSH_BYTES = 1 << 16       # Wake the writer once this much is buffered
+FLUSH_INTERVAL = 0.5        # Seconds between writes otherwise
+BUFFER_LIMIT = 1 << 24      # Drop records beyond this much unwritten data
+
+RESULT_NAMES = {RESULT_WIN: "win", RESULT_LOSS: "loss", RESULT_TIE: "tie"}
+VALID_CARDS = frozenset(DECK_CARDS)
+
+
+class RoundLog:
+    """Buffered writer for one round log file, safe to share between threads and an event loop."""
+
+    def __init__(self, path, buffer_limit=BUFFER_LIMIT, flush_interval=FLUSH_INTERVAL, log=print):
+        """
+        Args:
+            path: Log file, created with a header if missing and appended to otherwise
+            log: Callable for write failures, normally the owning server's log
+        """
+        self.path = path
+        self.log = log
+        self.buffer_limit = buffer_limit
+        self.flush_interval = flush_interval
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        header = os.pread(self.fd, LOG_HEADER_STRUCT.size, 0)
+        if not header:
+            os.write(self.fd, LOG_HEADER_STRUCT.pack(LOG_MAGIC, LOG_VERSION, ROUND_RECORD_STRUCT.size))
+        elif header != LOG_HEADER_STRUCT.pack(LOG_MAGIC, LOG_VERSION, ROUND_RECORD_STRUCT.size):
+            os.close(self.fd)
+            raise ValueError(f"{path} is not a version {LOG_VERSION} round log")
+        self.records = 0
+        self.dropped = 0
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._writer = threading.Thread(target=self._write_loop, name="round-log", daemon=True)
+        self._writer.start()
+
+    def record(self, session, team, shuffles, position, cards, hits, decisions, result):
+        """
+        Queue one round; never touches the disk.
+
+        Args:
+            session: Server-local session number
+            team: Team name as sent in the request (bytes)
+            shuffles, position: Shoe shuffle count and position when the round started
+            cards: Card ids in play_round deal order
+            hits: Bit i set if the player's decision i was a hit
+            decisions: Number of decisions the player made
+        """
+        if len(cards) > MAX_ROUND_CARDS:
+            self.dropped += 1
+            return
+        packed = ROUND_RECORD_STRUCT.pack(time.time(), session, team, shuffles, position, result,
+                                          decisions, len(cards), hits, bytes(cards))
+        with self._lock:
+            if len(self._buffer) >= self.buffer_limit:
+                self.dropped += 1
+                return
+            self._buffer += packed
+            self.records += 1
+            full = len(self._buffer) >= FLUSH_BYTES
+        if full:
+            self._wakeup.set()
+
+    def close(self):
+        """Write out everything queued so far and close the file."""
+        self._closed = True
+        self._wakeup.set()
+        self._writer.join()
+        os.close(self.fd)
+
+    def _write_loop(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            # Read before swapping: records queued after close() started still get one more pass
+            closing = self._closed
+            with self._lock:
+                data, self._buffer = self._buffer, bytearray()
+            if data:
+                self._write(data)
+            if closing:
+                return
+
+    def _write(self, data):
+        view = memoryview(data)
+        try:
+            while view:
+                view = view[os.write(self.fd, view):]
+        except OSError as e:
+            lost = len(view) // ROUND_RECORD_STRUCT.size
+            self.dropped += lost
+            self.log(f"Round log write failed, {lost} rounds lost: {e}")
+
+
+class RoundLogReader:
+    """Memory-mapped, random-access view of a round log; a torn last record is ignored."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < LOG_HEADER_STRUCT.size:
+                raise ValueError(f"{path} is not a round log")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size = LOG_HEADER_STRUCT.unpack_from(self._map)
+        if magic != LOG_MAGIC or version != LOG_VERSION or record_size != ROUND_RECORD_STRUCT.size:
+            self._map.close()
+            raise ValueError(f"{path} is not a version {LOG_VERSION} round log")
+        self._count = (size - LOG_HEADER_STRUCT.size) // record_size
+        self._view = memoryview(self._map)[LOG_HEADER_STRUCT.size:
+                                           LOG_HEADER_STRUCT.size + self._count * record_size]
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("round log index out of range")
+        return RoundRecord._make(ROUND_RECORD_STRUCT.unpack_from(self._view, index * ROUND_RECORD_STRUCT.size))
+
+    def __iter__(self):
+        return map(RoundRecord._make, ROUND_RECORD_STRUCT.iter_unpack(self._view))
+
+    def close(self):
+        self._view.release()
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def replay_round(record):
+    """
+    Re-play a logged round under play_round's rules.
+
+    Returns:
+        str or None: Why the record contradicts the rules, or None if it checks out
+    """
+    cards = record.cards[:record.card_count]
+    if len(cards) < 4:
+        return "fewer than four cards dealt"
+    if not VALID_CARDS.issuperset(cards):
+        return "invalid card id"
+    deck = iter(cards[4:])
+
+    player_hand = HandState(CARD_ID_VALUES[cards[0]], CARD_ID_VALUES[cards[1]])
+    for i in range(record.decisions):
+        if player_hand.busted:
+            return f"decision {i + 1} after the player busted"
+        if not record.hits >> i & 1:
+            if i != record.decisions - 1:
+                return f"decision {i + 2} after a stand"
+            break
+        card = next(deck, None)
+        if card is None:
+            return "player hit with no card logged"
+        player_hand.add(CARD_ID_VALUES[card])
+    else:
+        if not player_hand.busted:
+            return "player neither stood nor busted"
+    player_sum = player_hand.total
+
+    dealer_sum = 0  # A busted player loses without the dealer playing
+    if player_sum <= 21:
+        try:
+            dealer_sum, _ = play_dealer(cards[2], cards[3], deck.__next__)
+        except StopIteration:
+            return "dealer hit with no card logged"
+    result = settle(player_sum, dealer_sum)
+
+    if next(deck, None) is not None:
+        return "cards logged after the round ended"
+    if result != record.result:
+        return f"logged {RESULT_NAMES.get(record.result, hex(record.result))}, rules give {RESULT_NAMES[result]}"
+    return None
+
+
+def format_round(record):
+    """One human-readable line for a logged round."""
+    cards = record.cards[:record.card_count]
+    hit_count = bin(record.hits).count('1')
+    player = cards[:2] + cards[4:4 + hit_count]
+    dealer = cards[2:4] + cards[4 + hit_count:]
+    show = lambda hand: " ".join(decode_card(*encode_card(card))[1] for card in hand)
+    team = record.team.rstrip(b'\x00').decode('utf-8', errors='replace')
+    played = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record.time))
+    return (f"{played} session {record.session} {team}: player [{show(player)}] "
+            f"dealer [{show(dealer)}] -> {RESULT_NAMES.get(record.result, hex(record.result))}")
+
+
+def verify(paths, team=None, max_errors=10):
+    """
+    Replay every round in the given logs.
+
+    Returns:
+        tuple: (rounds checked, rounds that contradict the rules)
+    """
+    checked = failed = 0
+    team = team.encode('utf-8') if team is not None else None
+    for path in paths:
+        with RoundLogReader(path) as reader:
+            for index, record in enumerate(reader):
+                checked += 1
+                error = replay_round(record)
+                if error is not None:
+                    failed += 1
+                    if failed <= max_errors:
+                        print(f"{path}#{index}: {error}: {format_round(record)}")
+                if team is not None and record.team.rstrip(b'\x00') == team:
+                    print(format_round(record))
+    return checked, failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay and verify Blackijecky round logs")
+    parser.add_argument("logs", nargs="+", help="round log files written by server.py --round-log")
+    parser.add_argument("--team", default=None, help="print every round played by this team")
+    parser.add_argument("--max-errors", type=int, default=10, help="inconsistent rounds to print")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    checked, failed = verify(args.logs, args.team, args.max_errors)
+    elapsed = time.perf_counter() - started
+    print(f"Replayed {checked} rounds in {elapsed:.2f}s ({checked / max(elapsed, 1e-9):,.0f}/s), "
+          f"{failed} inconsistent")
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,124 @@
+"""
+Shared hand scoring and card encoding tables for the server and client.
+"""
+from constants import *
+
+DEALER_STAND = 17  # The dealer hits below this total and stands on every 17, soft or hard
+
+RANK_NAMES = {RANK_ACE: "A", RANK_JACK: "J", RANK_QUEEN: "Q", RANK_KING: "K"}
+
+# Decode tables indexed by network rank (0-13) / suit (0-3)
+CARD_VALUES = tuple(CARD_VALUE_ACE if rank == RANK_ACE else min(rank, 10) for rank in range(14))
+CARD_DISPLAY = tuple(
+    tuple(f"{RANK_NAMES.get(rank, str(rank))}{symbol}" for symbol in SUIT_SYMBOLS)
+    for rank in range(14)
+)
+
+# A real card packed into one byte: (rank << 2) | suit. Id 0 is "no card",
+# which encodes to the rank 0 / suit 0 the protocol already uses for it.
+NO_CARD = 0
+DECK_CARDS = bytes((rank << 2) | suit for rank in range(RANK_ACE, RANK_KING + 1)
+                   for suit in range(len(SUITS)))
+CARD_ID_LIMIT = (RANK_KING + 1) << 2
+
+# Encode tables indexed by card id
+CARD_RANKS = tuple(card >> 2 for card in range(CARD_ID_LIMIT))
+CARD_SUITS = tuple(card & 3 for card in range(CARD_ID_LIMIT))
+CARD_ID_VALUES = tuple(CARD_VALUES[card >> 2] for card in range(CARD_ID_LIMIT))
+
+
+def encode_card(card):
+    """
+    Network encoding of a card id.
+
+    Returns:
+        tuple: (rank, suit) where rank is 1-13 and suit is 0-3, (0, 0) for NO_CARD
+    """
+    return CARD_RANKS[card], CARD_SUITS[card]
+
+
+def decode_card(rank, suit):
+    """
+    Convert rank + suit from network to game value and display string.
+
+    Returns:
+        tuple: (card_value, display_string)
+    """
+    if 0 <= rank <= RANK_KING and 0 <= suit < len(SUIT_SYMBOLS):
+        return CARD_VALUES[rank], CARD_DISPLAY[rank][suit]
+    # Malformed card: keep the value readable, flag the suit
+    return (10 if rank > RANK_KING else rank), f"{RANK_NAMES.get(rank, str(rank))}?"
+
+
+def hand_value(cards):
+    """Score a whole list of card values (Aces count 11, reduced to 1 as needed)."""
+    total = sum(cards)
+    aces = cards.count(CARD_VALUE_ACE)
+    # Convert Aces from 11 to 1 as needed
+    while total > 21 and aces > 0:
+        total -= 10
+        aces -= 1
+    return total
+
+
+class HandState:
+    """
+    Incrementally scored hand: running total plus the number of Aces still
+    counted as 11, so adding a card is O(1) instead of rescanning the hand.
+    """
+    __slots__ = ('total', 'soft_aces')
+
+    def __init__(self, *cards):
+        self.total = 0
+        self.soft_aces = 0
+        for card in cards:
+            self.add(card)
+
+    def add(self, card_value):
+        self.total += card_value
+        if card_value == CARD_VALUE_ACE:
+            self.soft_aces += 1
+        # At most two Aces ever need demoting after one card
+        while self.total > 21 and self.soft_aces:
+            self.total -= 10
+            self.soft_aces -= 1
+        return self.total
+
+    @property
+    def soft(self):
+        return self.soft_aces > 0
+
+    @property
+    def busted(self):
+        return self.total > 21
+
+
+def play_dealer(up_card, hole_card, deal):
+    """
+    Play the dealer's hand out under the house rule: hit below DEALER_STAND.
+
+    Args:
+        up_card, hole_card: Card ids of the dealer's first two cards
+        deal: Callable returning the next card id from the shoe
+
+    Returns:
+        tuple: (dealer's final total, list of the card ids it hit, in order)
+    """
+    hand = HandState(CARD_ID_VALUES[up_card], CARD_ID_VALUES[hole_card])
+    hits = []
+    while hand.total < DEALER_STAND:
+        card = deal()
+        hand.add(CARD_ID_VALUES[card])
+        hits.append(card)
+    return hand.total, hits
+
+
+def settle(player_total, dealer_total):
+    """Result of a finished round for the player; a player bust loses whatever the dealer holds."""
+    if player_total > 21:
+        return RESULT_LOSS
+    if dealer_total > 21 or player_total > dealer_total:
+        return RESULT_WIN
+    if dealer_total > player_total:
+        return RESULT_LOSS
+    return RESULT_TIE
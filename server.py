@@ -1,215 +1,561 @@
+import itertools
 import socket
-import struct
 import threading
 import time
-import random
 from constants import *
+from metrics import Counters, Histogram, render_metrics, serve_metrics
+from scoring import HandState, CARD_ID_VALUES, NO_CARD, encode_card, play_dealer, settle
+from shoe import Shoe, RecordingShoe, PRIVATE_RESERVE
+from roundlog import RoundLog
+from broadcaster import OfferBroadcaster, parse_target
+from protocol import (PayloadBatch, RecvBuffer, SendQueue, OFFER_STRUCT, LOAD_HINT_STRUCT, LOAD_UNLIMITED,
+                      HEADER_STRUCT, REQUEST_BODIES, DECISION_STRUCT)
+
+# Server-side counters: results sent to players, sessions the server cut off,
+# traffic, and protocol errors by kind
+STAT_NAMES = ('rounds', 'wins', 'losses', 'ties',
+              'evicted_idle', 'evicted_decision', 'evicted_session', 'evicted_write', 'evicted_drain',
+              'rejected', 'sessions', 'drained', 'bytes_sent', 'bytes_received',
+              'error_incomplete', 'error_cookie', 'error_type', 'error_disconnected', 'error_client')
+RESULT_STAT = {RESULT_WIN: 'wins', RESULT_LOSS: 'losses', RESULT_TIE: 'ties'}
+STREAM_FLUSH_BYTES = 1 << 15  # v2 sessions are written out in chunks of about this size
+DRAIN_GRACE = 5.0  # Seconds past the drain deadline for in-flight rounds before connections are closed
+EVICTION_REASONS = {
+    'evicted_idle': "no request within the idle timeout",
+    'evicted_decision': "no decision within the decision timeout",
+    'evicted_session': "session deadline reached",
+    'evicted_write': "client stopped reading its packets",
+    'evicted_drain': "server shutting down, drain deadline reached",
+}
+
+
+class SessionEvicted(Exception):
+    """Raised when a session overruns one of the server's deadlines."""
+
+    def __init__(self, reason):
+        super().__init__(EVICTION_REASONS[reason])
+        self.reason = reason  # Counter in STAT_NAMES
+
+
+class ClientSession:
+    """Per-connection state reused across every round, and every keep-alive session, on it."""
+
+    def __init__(self, conn, shoe, session_timeout=None):
+        self.conn = conn
+        self.batch = PayloadBatch()
+        self.recv_buffer = RecvBuffer()  # Framed reads: requests and decisions may arrive split or pipelined
+        self.send_queue = SendQueue()    # Packets the client has not taken yet
+        self.shoe = shoe
+        self.deadline = session_deadline(session_timeout)  # Reset by each request
+        self.number = 0      # Server-local session number and team of the current request,
+        self.team = b''      # for the round log
+
+
+def session_deadline(session_timeout):
+    """Monotonic time a session must finish by, or None for no limit."""
+    return time.monotonic() + session_timeout if session_timeout else None
+
+
+def check_deadline(deadline):
+    if deadline is not None and time.monotonic() >= deadline:
+        raise SessionEvicted('evicted_session')
+
 
 class BlackjackServer:
-    def __init__(self, tcp_port=12345):
+    def __init__(self, tcp_port=12345, backlog=socket.SOMAXCONN, reuse_port=False, tcp_nodelay=True,
+                 decks=1, penetration=0.0, decision_timeout=30.0, session_timeout=None,
+                 idle_timeout=10.0, max_sessions=None, verbose=True, metrics_port=None, offer_load=False,
+                 keep_alive=False, round_log=None, write_high_water=1 << 16, write_timeout=10.0,
+                 offer_targets=None, offer_interval=1.0, offer_jitter=0.1, multicast_ttl=1,
+                 discovery_port=DISCOVERY_PORT, drain_timeout=30.0):
         self.tcp_port = tcp_port
+        # Append every round to this binary log (see roundlog.py); None disables it
+        self.round_log = RoundLog(round_log, log=self.log) if round_log else None
+        self.session_numbers = itertools.count(1)
+        # After a session's last result, wait up to idle_timeout for another request on the connection
+        self.keep_alive = keep_alive
+        # Append load hints to offers; clients that unpack exactly 39 bytes cannot parse them
+        self.offer_load = offer_load
+        # Where and how often offers go (see broadcaster.py); discovery_port=None ignores discover requests
+        self.offer_targets = offer_targets
+        self.offer_interval = offer_interval
+        self.offer_jitter = offer_jitter
+        self.multicast_ttl = multicast_ttl
+        self.discovery_port = discovery_port
+        # Per-event prints cost real time under load; counters below are always kept
+        self.verbose = verbose
+        self.metrics_port = metrics_port
+        # Deadlines in seconds (None disables): request after connecting, each decision, whole session
+        self.idle_timeout = idle_timeout
+        self.decision_timeout = decision_timeout
+        self.session_timeout = session_timeout
+        # Dealing to a connection pauses while more than write_high_water bytes are unsent;
+        # a client that keeps it there for write_timeout seconds is disconnected
+        self.write_high_water = write_high_water
+        self.write_timeout = write_timeout
+        # Connections beyond this many concurrent sessions are closed straight after accept
+        self.max_sessions = max_sessions
+        self.active_sessions = 0
+        # After stop(), running sessions get drain_timeout seconds (None: no limit) to play out;
+        # then each ends after its current round, and any still open DRAIN_GRACE later is closed
+        self.drain_timeout = drain_timeout
+        self.drain_deadline = None
+        self._sessions_lock = threading.Lock()
+        # Shoe configuration for every table; the default is a fresh single deck each round
+        self.decks = decks
+        self.penetration = penetration
+        # Disable Nagle on player sockets: each flush is a complete batch, never worth delaying
+        self.tcp_nodelay = tcp_nodelay
         self.server_name = "TeamDealer"
         self.running = True
+        self.stats = Counters(*STAT_NAMES)
+        self.round_time = Histogram()     # Wall time of each play_round, decisions included
+        self.decision_wait = Histogram()  # From flushing the cards to the decision arriving
+        self._last_scrape = (time.monotonic(), 0)
         # Setup TCP socket
         self.tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.tcp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            # Several processes bind the same port; the kernel spreads accepts between them
+            if not hasattr(socket, "SO_REUSEPORT"):
+                raise OSError("SO_REUSEPORT is not supported on this platform")
+            self.tcp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.tcp_sock.bind(('', self.tcp_port))
-        self.tcp_sock.listen()
+        self.tcp_sock.listen(backlog)
 
-    def start(self):
-        print(f"Server started, listening on IP address {self.get_local_ip()}") # [cite: 69]
+    def start(self, broadcast=True):
+        self.log(f"Server started, listening on IP address {self.get_local_ip()}") # [cite: 69]
+        self.start_metrics()
         
         # Start UDP Broadcast thread
-        udp_thread = threading.Thread(target=self.broadcast_offers, daemon=True)
-        udp_thread.start()
+        if broadcast:
+            udp_thread = threading.Thread(target=self.broadcast_offers, args=(self.open_broadcaster(),), daemon=True)
+            udp_thread.start()
+
+        # Wake up periodically so stop() is noticed without a new connection
+        self.tcp_sock.settimeout(0.5)
+        client_threads = {}  # Thread -> its connection
 
         # Listen for TCP connections
         while self.running:
             try:
                 client_sock, addr = self.tcp_sock.accept()
-                print(f"New connection from {addr}")
-                # Handle each client in a separate thread
-                client_thread = threading.Thread(target=self.handle_client, args=(client_sock,))
-                client_thread.start()
+                self.spawn_client(client_sock, addr, client_threads)
+                client_threads = {t: conn for t, conn in client_threads.items() if t.is_alive()}
+            except socket.timeout:
+                continue
             except Exception as e:
-                print(f"Error accepting connection: {e}")
+                self.log(f"Error accepting connection: {e}")
 
-    def broadcast_offers(self):
-        """Sends UDP offers every 1 second."""
-        udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        
+        # Graceful shutdown: no new players, let running sessions finish
+        for client_sock, addr in self.accept_backlog():
+            self.spawn_client(client_sock, addr, client_threads)
+        self.tcp_sock.close()
+        self.log(f"Draining {self.active_sessions} sessions")
+        for client_thread in client_threads:
+            client_thread.join(self.drain_wait())
+        for client_thread, conn in client_threads.items():
+            if client_thread.is_alive():
+                # Past the grace period: unblock the thread; it closes the connection and exits
+                self.stats.incr('evicted_drain')
+                try:
+                    conn.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                client_thread.join(1.0)
+        if self.round_log is not None:
+            self.round_log.close()
+
+    def spawn_client(self, client_sock, addr, client_threads):
+        """Handle a new connection on its own thread, or refuse it at capacity."""
+        if not self.open_session():
+            # At capacity: refuse before spending a thread on it
+            self.stats.incr('rejected')
+            client_sock.close()
+            return
+        self.log(f"New connection from {addr}")
+        # Daemon, so a thread stuck past the drain deadline cannot keep the process alive
+        client_thread = threading.Thread(target=self.handle_client, args=(client_sock,), daemon=True)
+        client_thread.start()
+        client_threads[client_thread] = client_sock
+
+    def accept_backlog(self):
+        """
+        Connections the kernel already completed but nobody accepted yet.
+
+        Closing the listening socket would reset them, so they are served
+        with the draining sessions instead.
+        """
+        self.tcp_sock.setblocking(False)
+        while True:
+            try:
+                yield self.tcp_sock.accept()
+            except OSError:  # BlockingIOError: the backlog is empty
+                return
+
+    def stop(self):
+        """
+        Begin draining: stop accepting players and sending offers, let running sessions finish.
+
+        start() returns once they have, or drain_timeout plus DRAIN_GRACE later.
+        Calling stop() again (a second signal) ends every session after its current round.
+        """
+        now = time.monotonic()
+        if not self.running:
+            self.drain_deadline = now
+        elif self.drain_timeout is not None:
+            self.drain_deadline = now + self.drain_timeout
+        self.running = False
+
+    def drain_wait(self):
+        """Seconds left to wait for draining sessions, or None to wait for as long as they take."""
+        if self.drain_deadline is None:
+            return None
+        return max(self.drain_deadline + DRAIN_GRACE - time.monotonic(), 0)
+
+    def drain_expired(self):
+        """True once sessions must stop starting rounds."""
+        return self.drain_deadline is not None and time.monotonic() >= self.drain_deadline
+
+    def check_drain(self):
+        """Call between rounds: ends the session once the drain deadline has passed."""
+        if self.drain_expired():
+            raise SessionEvicted('evicted_drain')
+
+    def drain_summary(self):
+        stats = self.stats.snapshot()
+        return (f"Drained {stats['drained']} sessions, {stats['evicted_drain']} stopped early "
+                f"at the drain deadline")
+
+    def log(self, *args):
+        if self.verbose:
+            print(*args)
+
+    def start_metrics(self):
+        """Serve render_metrics() on localhost if a metrics port is configured."""
+        if self.metrics_port is not None:
+            serve_metrics(self.render_metrics, self.metrics_port)
+
+    def render_metrics(self):
+        snapshot = self.stats.snapshot()
+        # rounds/s over the interval since the previous scrape
+        now = time.monotonic()
+        last_time, last_rounds = self._last_scrape
+        self._last_scrape = (now, snapshot['rounds'])
+        gauges = {
+            'active_sessions': self.active_sessions,
+            'rounds_per_second': (snapshot['rounds'] - last_rounds) / max(now - last_time, 1e-9),
+        }
+        if self.round_log is not None:
+            gauges['round_log_dropped'] = self.round_log.dropped
+        histograms = {
+            'play_round_seconds': self.round_time,
+            'decision_wait_seconds': self.decision_wait,
+        }
+        return render_metrics('blackjack', snapshot, gauges, histograms)
+
+    def protocol_error(self, name, message):
+        self.stats.incr(name)
+        self.log(message)
+
+    def send_batch(self, session, drain=True):
+        """
+        Queue the session's PayloadBatch, counted in bytes_sent, and write it without blocking.
+
+        Args:
+            drain: Wait until the client has everything (it must see its cards before
+                deciding); otherwise only wait while write_high_water bytes are unsent
+
+        Raises:
+            SessionEvicted: if the client does not take its packets within write_timeout
+        """
+        self.stats.incr('bytes_sent', len(session.batch))
+        session.batch.move_to(session.send_queue)
+        try:
+            session.send_queue.flush(session.conn, 0 if drain else self.write_high_water, self.write_timeout)
+        except socket.timeout:
+            raise SessionEvicted('evicted_write')
+
+    def read_frame(self, session, layout, timeout):
+        """RecvBuffer.read on the session's socket, counted in bytes_received."""
+        values = session.recv_buffer.read(session.conn, layout, timeout)
+        if values is not None:
+            self.stats.incr('bytes_received', layout.size)
+        return values
+
+    def record_result(self, result):
+        self.stats.incr('rounds')
+        self.stats.incr(RESULT_STAT[result])
+
+    def open_session(self):
+        """Reserve a session slot; False if max_sessions are already active."""
+        with self._sessions_lock:
+            if self.max_sessions is not None and self.active_sessions >= self.max_sessions:
+                return False
+            self.active_sessions += 1
+            return True
+
+    def close_session(self):
+        with self._sessions_lock:
+            self.active_sessions -= 1
+        if not self.running:
+            self.stats.incr('drained')
+
+    def evict(self, error):
+        self.stats.incr(error.reason)
+        self.log(f"Evicting client: {error}")
+
+    def decision_timeout_for(self, deadline):
+        """
+        How long to wait for the next decision of a session.
+
+        Returns:
+            tuple: (timeout in seconds or None, counter to charge if it runs out)
+        """
+        if deadline is None:
+            return self.decision_timeout, 'evicted_decision'
+        check_deadline(deadline)
+        remaining = deadline - time.monotonic()
+        if self.decision_timeout is None or remaining < self.decision_timeout:
+            return remaining, 'evicted_session'
+        return self.decision_timeout, 'evicted_decision'
+
+    def build_offer_packet(self):
         # Format: Cookie(4), Type(1), Port(2), Name(32) [cite: 85-90]
         # '!' = Network (Big Endian), I=Int(4), B=Byte(1), H=Short(2), 32s=String(32)
-        packet = struct.pack('!IBH32s', 
-                             MAGIC_COOKIE, 
-                             MSG_TYPE_OFFER, 
-                             self.tcp_port, 
-                             self.server_name.encode('utf-8').ljust(32, b'\x00')) # Padding to 32 bytes
+        packet = OFFER_STRUCT.pack(MAGIC_COOKIE, 
+                                   MSG_TYPE_OFFER, 
+                                   self.tcp_port, 
+                                   self.server_name.encode('utf-8').ljust(32, b'\x00')) # Padding to 32 bytes
+        if self.offer_load:
+            packet += LOAD_HINT_STRUCT.pack(*self.load_hints())
+        return packet
 
-        while self.running:
-            try:
-                udp_sock.sendto(packet, ('<broadcast>', UDP_PORT))
-                time.sleep(1) # [cite: 70]
-            except Exception as e:
-                print(f"Broadcasting error: {e}")
+    def load_hints(self):
+        """
+        Returns:
+            tuple: (active sessions, free session slots), capped to the 16-bit offer fields
+        """
+        active = self.active_sessions
+        if self.max_sessions is None:
+            free = LOAD_UNLIMITED
+        else:
+            free = max(self.max_sessions - active, 0)
+        return min(active, LOAD_UNLIMITED), min(free, LOAD_UNLIMITED)
 
-    def handle_client(self, conn):
+    def open_broadcaster(self):
+        """Sockets for every offer target, opened up front so a bad target fails at startup."""
+        return OfferBroadcaster(self.build_offer_packet, self.offer_targets, self.offer_interval, self.offer_jitter,
+                                refresh=self.offer_load, discovery_port=self.discovery_port,
+                                multicast_ttl=self.multicast_ttl, log=self.log)
+
+    def broadcast_offers(self, broadcaster):
+        """Sends UDP offers every offer_interval seconds and answers discover requests."""
         try:
-            # 1. Receive Request Message (TCP)
-            # Format: Cookie(4), Type(1), Rounds(1), Name(32) [cite: 91-95]
-            data = conn.recv(1024)
-            if len(data) < 38: # Minimum size check
-                print("Received incomplete request packet")
-                return
-            
-            cookie, msg_type, rounds, team_name = struct.unpack('!IBB32s', data[:38])
-            
-            if cookie != MAGIC_COOKIE:
-                print(f"Invalid magic cookie received: {hex(cookie)}")
-                return
-            
-            if msg_type != MSG_TYPE_REQUEST:
-                print(f"Invalid message type received: {hex(msg_type)}")
-                return
+            broadcaster.run(lambda: self.running)
+        finally:
+            broadcaster.close()
 
-            team_name = team_name.decode('utf-8').strip('\x00')
-            print(f"Starting game with {team_name} for {rounds} rounds")
+    def handle_client(self, conn):
+        try:
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(self.tcp_nodelay))
 
-            # 2. Game Logic Loop
-            for i in range(rounds):
-                self.play_round(conn)
-            
-            print(f"Finished playing with {team_name}")
+            # One outgoing buffer, receive buffer and shoe reused for the whole connection
+            session = ClientSession(conn, self.new_shoe(), self.session_timeout)
+            first = True
+            # While draining, a finished session is not followed by another on the connection
+            while self.serve_session(session, first) and self.keep_alive and self.running:
+                first = False
             
+        except SessionEvicted as e:
+            self.evict(e)
+            if e.reason == 'evicted_drain':
+                # Stopped between rounds: results already dealt still reach the client
+                try:
+                    self.send_batch(session)
+                except (SessionEvicted, OSError):
+                    pass
         except Exception as e:
-            print(f"Client error: {e}")
+            self.protocol_error('error_client', f"Client error: {e}")
         finally:
             conn.close()
+            self.close_session()
 
-    def encode_card_for_network(self, card_value):
+    def serve_session(self, session, first=True):
         """
-        Convert internal card value to rank + suit encoding for network transmission.
+        Read one request from the connection and play its rounds.
+
+        Args:
+            first: False for keep-alive requests, where a clean close is not an error
+
+        Returns:
+            bool: True if every round was played, so another request may follow
+        """
+        # 1. Receive Request Message (TCP)
+        # v1: Cookie(4), Type(1), Rounds(1), Name(32) [cite: 91-95]
+        # v2: Cookie(4), Type(1), Rounds(4), Name(32), Hard policy(10), Soft policy(10)
+        try:
+            header = self.read_frame(session, HEADER_STRUCT, self.idle_timeout)
+            if header is None:
+                if first or len(session.recv_buffer):
+                    self.protocol_error('error_incomplete', "Received incomplete request packet")
+                return False
+
+            cookie, msg_type = header
+
+            if cookie != MAGIC_COOKIE:
+                self.protocol_error('error_cookie', f"Invalid magic cookie received: {hex(cookie)}")
+                return False
+
+            if msg_type not in REQUEST_BODIES:
+                self.protocol_error('error_type', f"Invalid message type received: {hex(msg_type)}")
+                return False
+
+            body = self.read_frame(session, REQUEST_BODIES[msg_type], self.idle_timeout)
+        except socket.timeout:
+            raise SessionEvicted('evicted_idle')
+        if body is None:
+            self.protocol_error('error_incomplete', "Received incomplete request packet")
+            return False
+
+        rounds, team_name = body[:2]
+        team_name = team_name.decode('utf-8').strip('\x00')
+        self.log(f"Starting game with {team_name} for {rounds} rounds")
+        self.stats.incr('sessions')
+        session.deadline = session_deadline(self.session_timeout)
+        session.number, session.team = next(self.session_numbers), body[1]
+
+        # 2. Game Logic Loop
+        if msg_type == MSG_TYPE_REQUEST_V2:
+            self.stream_rounds(session, rounds, *body[2:])
+        else:
+            for i in range(rounds):
+                self.check_drain()
+                started = time.perf_counter()
+                alive = self.play_round(session)
+                self.round_time.observe(time.perf_counter() - started)
+                if not alive:
+                    return False
+
+        # Results may still be queued; they go out before the connection is reused or closed
+        self.send_batch(session)
+        self.log(f"Finished playing with {team_name}")
+        return True
+
+    def new_shoe(self, decks=None):
+        # Logged rounds need the cards each round dealt
+        shoe_class = RecordingShoe if self.round_log is not None else Shoe
+        return shoe_class(decks or self.decks, self.penetration)
+
+    def log_round(self, session, team, shoe, hits, decisions, result):
+        """
+        Queue a round dealt from a RecordingShoe for the round log, if one is configured.
+
+        Args:
+            hits: Bit i set if the player's decision i was a hit
+            decisions: Number of decisions the player made
+        """
+        if self.round_log is not None:
+            self.round_log.record(session, team, *shoe.round_start, shoe.dealt, hits, decisions, result)
+
+    def encode_card_for_network(self, card):
+        """
+        Convert a dealt card id to rank + suit encoding for network transmission.
         
         Args:
-            card_value: Internal game value (2-11)
+            card: Card id from the table's Shoe, or NO_CARD
             
         Returns:
             tuple: (rank, suit) where rank is 1-13 and suit is 0-3
         """
-        # Randomly assign a suit (0-3: Heart, Diamond, Club, Spade)
-        suit = random.randint(0, 3)
-        
-        # Map internal value to rank
-        if card_value == CARD_VALUE_ACE:  # 11
-            rank = RANK_ACE  # Ace is rank 1
-        elif card_value == 10:
-            # Could be 10, J, Q, or K - randomly choose for variety
-            rank = random.choice([10, RANK_JACK, RANK_QUEEN, RANK_KING])
-        else:
-            # 2-9 map directly to their rank
-            rank = card_value
-        
-        return rank, suit
-
-    def play_round(self, conn):
-        def build_deck():
-            # Standard 52-card deck, values only (Ace handled in hand_value)
-            deck = []
-            for _ in range(4):
-                # 2-10, J, Q, K as 10, Ace as CARD_VALUE_ACE
-                deck.extend([2,3,4,5,6,7,8,9,10,10,10,10,CARD_VALUE_ACE])
-            random.shuffle(deck)
-            return deck
-
-        def hand_value(cards):
-            total = sum(cards)
-            aces = cards.count(CARD_VALUE_ACE)
-            # Convert Aces from 11 to 1 as needed
-            while total > 21 and aces > 0:
-                total -= 10
-                aces -= 1
-            return total
-
-        def draw_card(deck):
-            if not deck:
-                deck.extend(build_deck())
-            return deck.pop()
-
-        def send_payload(status, card_val):
+        return encode_card(card)
+
+    def play_round(self, session):
+        """
+        Play one round over the session's connection.
+
+        Returns:
+            bool: False if the client went away or broke protocol mid-round
+
+        Raises:
+            SessionEvicted: if a decision or the session deadline runs out
+        """
+        batch, shoe = session.batch, session.shoe
+
+        def send_payload(status, card):
             """
-            Send payload packet to client.
+            Queue payload packet for the client; sent on the next send_batch().
             Format: Cookie(4) + Type(1) + Result(1) + card_rank(2) + card_suit(1) = 9 bytes
             
             Args:
                 status: Game status (RESULT_WIN, RESULT_LOSS, RESULT_TIE, RESULT_CONTINUE)
-                card_val: Internal card value (2-11), or 0 if no card to send
+                card: Card id, or NO_CARD if no card to send
             """
-            # Encode card to rank + suit if there's a card to send
-            if card_val > 0:
-                rank, suit = self.encode_card_for_network(card_val)
-            else:
-                rank, suit = 0, 0
-            
-            # Pack: Cookie(4) + Type(1) + Status(1) + Rank(2) + Suit(1) = 9 bytes
-            packet = struct.pack('!IBBHB',
-                                 MAGIC_COOKIE,
-                                 MSG_TYPE_PAYLOAD,
-                                 status,
-                                 rank,
-                                 suit)
-            conn.sendall(packet)
-
-        # Build deck and initial deal
-        deck = build_deck()
-        player_cards = [draw_card(deck), draw_card(deck)]
-        dealer_cards = [draw_card(deck), draw_card(deck)]  # dealer_cards[1] is hidden initially
-
-        player_sum = hand_value(player_cards)
+            rank, suit = self.encode_card_for_network(card)
+            batch.add(status, rank, suit)
+
+        check_deadline(session.deadline)
+
+        # Initial deal from the table's shoe
+        shoe.start_round(PRIVATE_RESERVE)
+        player_first, player_second = shoe.deal(), shoe.deal()
+        dealer_up_card, dealer_hole_card = shoe.deal(), shoe.deal()  # Hole card is hidden initially
+
+        player_hand = HandState(CARD_ID_VALUES[player_first], CARD_ID_VALUES[player_second])
+        player_sum = player_hand.total
+        hits = decisions = 0  # For the round log
 
         # Send player's initial two cards one by one
-        send_payload(RESULT_CONTINUE, player_cards[0])
-        send_payload(RESULT_CONTINUE, player_cards[1])
+        send_payload(RESULT_CONTINUE, player_first)
+        send_payload(RESULT_CONTINUE, player_second)
 
         # Send dealer's visible up-card (third initial packet)
-        dealer_up_card = dealer_cards[0]
         send_payload(RESULT_CONTINUE, dealer_up_card)
 
         # Player turn
         while True:
             if player_sum > 21:
-                send_payload(RESULT_LOSS, 0)
-                return
+                send_payload(RESULT_LOSS, NO_CARD)
+                self.send_batch(session, drain=False)
+                self.record_result(RESULT_LOSS)
+                self.log_round(session.number, session.team, shoe, hits, decisions, RESULT_LOSS)
+                return True
+
+            # Everything dealt so far must reach the client before it can decide
+            self.send_batch(session)
 
             # Receive client decision: Cookie(4) + Type(1) + Decision(5) = 10 bytes
-            decision_raw = conn.recv(10)
-            if not decision_raw or len(decision_raw) < 10:
-                print("Client disconnected or sent incomplete decision packet")
-                return
-            
+            # A pipelining client may already have this decision (and later ones) buffered
+            timeout, reason = self.decision_timeout_for(session.deadline)
+            waiting_since = time.perf_counter()
             try:
-                cookie, msg_type, decision_bytes = struct.unpack('!IB5s', decision_raw)
-                
-                # Validate magic cookie and message type
-                if cookie != MAGIC_COOKIE:
-                    print(f"Invalid magic cookie in decision: {hex(cookie)}")
-                    return
-                
-                if msg_type != MSG_TYPE_PAYLOAD:
-                    print(f"Invalid message type in decision: {hex(msg_type)}")
-                    return
-                
-                decision = decision_bytes.decode('utf-8', errors='ignore').strip('\x00').lower()
-                
-            except Exception as e:
-                print(f"Error parsing decision packet: {e}")
-                return
+                decision_packet = self.read_frame(session, DECISION_STRUCT, timeout)
+            except socket.timeout:
+                raise SessionEvicted(reason)
+            self.decision_wait.observe(time.perf_counter() - waiting_since)
+            if decision_packet is None:
+                self.protocol_error('error_disconnected', "Client disconnected or sent incomplete decision packet")
+                return False
+            
+            cookie, msg_type, decision_bytes = decision_packet
+            
+            # Validate magic cookie and message type
+            if cookie != MAGIC_COOKIE:
+                self.protocol_error('error_cookie', f"Invalid magic cookie in decision: {hex(cookie)}")
+                return False
+            
+            if msg_type != MSG_TYPE_PAYLOAD:
+                self.protocol_error('error_type', f"Invalid message type in decision: {hex(msg_type)}")
+                return False
+            
+            decision = decision_bytes.decode('utf-8', errors='ignore').strip('\x00').lower()
+            decisions += 1
             
             if decision.startswith('h'):
                 # Hit - draw another card
-                new_card = draw_card(deck)
-                player_cards.append(new_card)
-                player_sum = hand_value(player_cards)
+                hits |= 1 << (decisions - 1)
+                new_card = shoe.deal()
+                player_sum = player_hand.add(CARD_ID_VALUES[new_card])
                 send_payload(RESULT_CONTINUE, new_card)
                 continue
             else:
@@ -217,29 +563,83 @@ class BlackjackServer:
                 break
 
         # Dealer turn (only if player not busted)
-        dealer_sum = hand_value(dealer_cards)
+        dealer_sum, dealer_hits = play_dealer(dealer_up_card, dealer_hole_card, shoe.deal)
 
-        # Reveal dealer's hidden card (second initial card) to the client
-        send_payload(RESULT_CONTINUE, dealer_cards[1])
-
-        while dealer_sum < 17:
-            new_card = draw_card(deck)
-            dealer_cards.append(new_card)
-            dealer_sum = hand_value(dealer_cards)
-            # Send dealer hits
+        # Reveal dealer's hidden card (second initial card), then the dealer's hits
+        send_payload(RESULT_CONTINUE, dealer_hole_card)
+        for new_card in dealer_hits:
             send_payload(RESULT_CONTINUE, new_card)
 
         # Decide outcome
-        if dealer_sum > 21:
-            result = RESULT_WIN
-        elif player_sum > dealer_sum:
-            result = RESULT_WIN
-        elif dealer_sum > player_sum:
+        result = settle(player_sum, dealer_sum)
+
+        # Reveal, dealer hits and result go out as one send; the next round can be
+        # dealt while they are still on their way
+        send_payload(result, NO_CARD)
+        self.send_batch(session, drain=False)
+        self.record_result(result)
+        self.log_round(session.number, session.team, shoe, hits, decisions, result)
+        return True
+
+    def stream_rounds(self, session, rounds, hard, soft):
+        """
+        Play a v2 session: every round under the client's policy, written out in bulk.
+
+        Raises:
+            SessionEvicted: if the client stops reading or the session deadline runs out
+        """
+        batch = session.batch
+        for i in range(rounds):
+            self.play_policy_round(session.shoe, batch, hard, soft, session.number, session.team)
+            if len(batch) >= STREAM_FLUSH_BYTES or i == rounds - 1:
+                check_deadline(session.deadline)
+                # Keeps dealing while the client keeps up; pauses above the high-water mark
+                self.send_batch(session, drain=False)
+                if i < rounds - 1:
+                    self.check_drain()
+
+    def play_policy_round(self, shoe, batch, hard, soft, session=0, team=b''):
+        """
+        Play one round without decisions: the player hits below the policy threshold.
+
+        Queues exactly the packets an interactive round sends; no I/O.
+
+        Args:
+            hard, soft: Hit-below thresholds per dealer up-card 2-11 (see strategy.hit_below_policy)
+            session, team: Identify the session in the round log
+        """
+        shoe.start_round(PRIVATE_RESERVE)
+        player_first, player_second = shoe.deal(), shoe.deal()
+        dealer_up_card, dealer_hole_card = shoe.deal(), shoe.deal()
+
+        player_hand = HandState(CARD_ID_VALUES[player_first], CARD_ID_VALUES[player_second])
+        up_index = CARD_ID_VALUES[dealer_up_card] - 2
+        batch.add(RESULT_CONTINUE, *encode_card(player_first))
+        batch.add(RESULT_CONTINUE, *encode_card(player_second))
+        batch.add(RESULT_CONTINUE, *encode_card(dealer_up_card))
+
+        hit_count = 0
+        while not player_hand.busted and player_hand.total < (soft if player_hand.soft else hard)[up_index]:
+            new_card = shoe.deal()
+            player_hand.add(CARD_ID_VALUES[new_card])
+            batch.add(RESULT_CONTINUE, *encode_card(new_card))
+            hit_count += 1
+        player_sum = player_hand.total
+
+        if player_sum > 21:
             result = RESULT_LOSS
+            decisions = hit_count
         else:
-            result = RESULT_TIE
+            decisions = hit_count + 1  # The policy's stand
+            dealer_sum, dealer_hits = play_dealer(dealer_up_card, dealer_hole_card, shoe.deal)
+            batch.add(RESULT_CONTINUE, *encode_card(dealer_hole_card))
+            for new_card in dealer_hits:
+                batch.add(RESULT_CONTINUE, *encode_card(new_card))
+            result = settle(player_sum, dealer_sum)
 
-        send_payload(result, 0)
+        batch.add(result, *encode_card(NO_CARD))
+        self.record_result(result)
+        self.log_round(session, team, shoe, (1 << hit_count) - 1, decisions, result)
 
     def get_local_ip(self):
         # Utility to get local IP (simplified)
@@ -253,5 +653,99 @@ class BlackjackServer:
             return "127.0.0.1"
 
 if __name__ == "__main__":
-    server = BlackjackServer()
-    server.start()
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Blackijecky server")
+    parser.add_argument("--port", type=int, default=12345, help="TCP port to accept players on")
+    parser.add_argument("--mode", choices=["threaded", "async", "prefork"], default="threaded",
+                        help="threaded: one thread per connection; async: single asyncio event loop; "
+                             "prefork: several worker processes sharing the port")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="prefork: number of worker processes (default: CPU count)")
+    parser.add_argument("--worker-mode", choices=["threaded", "async"], default="async",
+                        help="prefork: engine each worker runs")
+    parser.add_argument("--no-nodelay", action="store_true",
+                        help="leave Nagle's algorithm enabled on player sockets")
+    parser.add_argument("--table-size", type=int, default=1,
+                        help="async engine, also in prefork workers: seats sharing one dealer hand per round "
+                             "(1: private tables)")
+    parser.add_argument("--decks", type=int, default=1, help="decks in each table's shoe")
+    parser.add_argument("--penetration", type=float, default=0.0,
+                        help="fraction of the shoe dealt before reshuffling (0: fresh shoe every round)")
+    parser.add_argument("--idle-timeout", type=float, default=10.0,
+                        help="seconds a new connection may take to send its request")
+    parser.add_argument("--decision-timeout", type=float, default=30.0,
+                        help="seconds a player may take over each hit/stand decision")
+    parser.add_argument("--session-timeout", type=float, default=None,
+                        help="seconds a whole session may last (default: unlimited)")
+    parser.add_argument("--max-sessions", type=int, default=None,
+                        help="concurrent sessions per process; extra connections are closed at once")
+    parser.add_argument("--quiet", action="store_true",
+                        help="skip per-connection and per-error prints (counters are still kept)")
+    parser.add_argument("--keep-alive", action="store_true",
+                        help="keep connections open after a session for further requests (up to --idle-timeout)")
+    parser.add_argument("--offer-load", action="store_true",
+                        help="append active sessions and free slots to offers (needs updated clients)")
+    parser.add_argument("--offer-target", action="append", default=None, metavar="HOST[:PORT][@IFACE_IP]",
+                        help="send offers here instead of the limited broadcast address; repeat for several "
+                             "subnet broadcast, unicast or multicast targets, optionally from a local interface IP")
+    parser.add_argument("--offer-interval", type=float, default=1.0, help="seconds between offers")
+    parser.add_argument("--offer-jitter", type=float, default=0.1,
+                        help="randomly stretch or shrink each offer interval by up to this fraction")
+    parser.add_argument("--multicast-ttl", type=int, default=1, help="hops multicast offers may travel")
+    parser.add_argument("--no-discovery", action="store_true",
+                        help=f"ignore discover requests on UDP port {DISCOVERY_PORT} "
+                             "(clients then wait for the next offer)")
+    parser.add_argument("--drain-timeout", type=float, default=30.0,
+                        help="on SIGTERM/SIGINT, seconds running sessions get to finish before each ends "
+                             "after its current round (a second signal does that at once)")
+    parser.add_argument("--reuse-port", action="store_true",
+                        help="bind with SO_REUSEPORT, so a replacement server can take over the port "
+                             "while this one drains")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve counters and histograms as text on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--write-high-water", type=int, default=1 << 16,
+                        help="unsent bytes per connection above which dealing to it pauses")
+    parser.add_argument("--write-timeout", type=float, default=10.0,
+                        help="seconds a client may leave the high-water mark unread before it is disconnected")
+    parser.add_argument("--round-log", default=None,
+                        help="append every round to this binary log, see roundlog.py "
+                             "(prefork: one file per worker, PATH.N)")
+    args = parser.parse_args()
+    if args.table_size > 1 and (args.mode == "threaded" or args.mode == "prefork" and args.worker_mode != "async"):
+        parser.error("--table-size needs the async engine (--mode async, or --mode prefork --worker-mode async)")
+    offer_targets = [parse_target(target) for target in args.offer_target] if args.offer_target else None
+    shoe_options = dict(decks=args.decks, penetration=args.penetration)
+    session_options = dict(idle_timeout=args.idle_timeout, decision_timeout=args.decision_timeout,
+                           session_timeout=args.session_timeout, max_sessions=args.max_sessions,
+                           verbose=not args.quiet, offer_load=args.offer_load, keep_alive=args.keep_alive,
+                           round_log=args.round_log, write_high_water=args.write_high_water,
+                           write_timeout=args.write_timeout, offer_targets=offer_targets,
+                           offer_interval=args.offer_interval, offer_jitter=args.offer_jitter,
+                           multicast_ttl=args.multicast_ttl,
+                           discovery_port=None if args.no_discovery else DISCOVERY_PORT,
+                           drain_timeout=args.drain_timeout)
+
+    if args.mode == "prefork":
+        from prefork import PreforkServer
+        server = PreforkServer(tcp_port=args.port, workers=args.workers, worker_mode=args.worker_mode,
+                               table_size=args.table_size, metrics_port=args.metrics_port,
+                               tcp_nodelay=not args.no_nodelay, **shoe_options, **session_options)
+    elif args.mode == "async":
+        from async_server import AsyncBlackjackServer
+        server = AsyncBlackjackServer(tcp_port=args.port, tcp_nodelay=not args.no_nodelay,
+                                      reuse_port=args.reuse_port, table_size=args.table_size,
+                                      metrics_port=args.metrics_port,
+                                      **shoe_options, **session_options)
+    else:
+        server = BlackjackServer(tcp_port=args.port, tcp_nodelay=not args.no_nodelay,
+                                 reuse_port=args.reuse_port, metrics_port=args.metrics_port,
+                                 **shoe_options, **session_options)
+    if args.mode != "prefork":
+        # Drain on a signal instead of dying mid-round (PreforkServer installs its own handlers)
+        import signal
+        signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
+        signal.signal(signal.SIGINT, lambda signum, frame: server.stop())
+    server.start()
+    if args.mode != "prefork":
+        print(server.drain_summary())
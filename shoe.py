@@ -0,0 +1,82 @@
+"""
+Persistent multi-deck shoe of real cards for one table.
+"""
+from array import array
+from rng import ShuffleRNG, thread_rng
+from scoring import DECK_CARDS
+
+# Most cards one hand can hold: eleven totalling 21 (four Aces, four 2s, three 3s), then a bust card
+HAND_CARDS = 12
+PRIVATE_RESERVE = 2 * HAND_CARDS  # A private round: the player's hand and the dealer's
+
+
+class Shoe:
+    """
+    N decks of card ids (see scoring.DECK_CARDS) in one compact array.
+
+    Dealing only advances an index. The whole array is reshuffled in place
+    once the cut card is reached, so rounds build and allocate no decks.
+    """
+
+    def __init__(self, decks=1, penetration=0.0, seed=None):
+        """
+        Args:
+            decks: Number of 52-card decks in the shoe
+            penetration: Fraction of the shoe dealt before the cut card comes out;
+                0 reshuffles before every round (a fresh deck per round)
+            seed: Seed for a reproducible shoe with its own generator; None shuffles with
+                the dealing thread's generator (see rng.thread_rng)
+        """
+        self.cards = array('B', DECK_CARDS * decks)
+        self.cut = int(len(self.cards) * penetration)
+        self.rng = ShuffleRNG(seed) if seed is not None else None
+        self.position = 0
+        self.shuffles = 0
+        self.shuffle()
+
+    def __len__(self):
+        """Cards left before the shoe is exhausted."""
+        return len(self.cards) - self.position
+
+    def shuffle(self):
+        (self.rng or thread_rng()).shuffle(self.cards)
+        self.position = 0
+        self.shuffles += 1
+
+    def start_round(self, reserve=0):
+        """
+        Reshuffle between rounds once the cut card has been dealt.
+
+        Args:
+            reserve: Also reshuffle if fewer cards than this are left, so a round
+                needing up to `reserve` cards never reshuffles cards already on the table
+        """
+        if self.position and (self.position >= self.cut or len(self) < reserve):
+            self.shuffle()
+
+    def deal(self):
+        """Next card id. An exhausted shoe is reshuffled mid-round, like a fresh deck."""
+        if self.position == len(self.cards):
+            self.shuffle()
+        card = self.cards[self.position]
+        self.position += 1
+        return card
+
+
+class RecordingShoe(Shoe):
+    """Shoe that also keeps the cards dealt since the last start_round, for the round log."""
+
+    def __init__(self, decks=1, penetration=0.0, seed=None):
+        self.dealt = bytearray()
+        self.round_start = (0, 0)  # (shuffles, position) when the current round started
+        super().__init__(decks, penetration, seed)
+
+    def start_round(self, reserve=0):
+        super().start_round(reserve)
+        self.round_start = (self.shuffles, self.position)
+        self.dealt.clear()
+
+    def deal(self):
+        card = super().deal()
+        self.dealt.append(card)
+        return card
@@ -0,0 +1,223 @@
+"""
+Offline Monte Carlo simulation of Blackijecky rounds.
+
+Deals and resolves whole batches of rounds as NumPy array operations using
+the same rules as BlackjackServer.play_round with its default shoe: a fresh
+shuffled shoe of scoring.DECK_CARDS per round, the player receives two
+cards, the dealer two (one hidden), the player hits under a strategy, a
+bust loses immediately, and the dealer hits below 17 (standing on soft 17).
+
+The number of decks and whether the dealer hits soft 17 are parameters,
+so EV can be compared across rule sets; the server plays with decks from
+its --decks option, standing on soft 17, and a fresh shoe every round when
+started with --penetration 0.
+
+NumPy is an optional dependency, needed only for this module.
+"""
+import argparse
+import math
+from constants import *
+from scoring import DECK_CARDS, CARD_ID_VALUES, DEALER_STAND
+from strategy import STRATEGIES, hit_below_policy, policy_strategy
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+
+def policy_table(strategy):
+    """
+    Tabulate a strategy.py callable as a boolean array indexed [soft, total, dealer_up].
+
+    Totals above 21 never hit; the table is padded so any clipped total is a valid index.
+    """
+    table = np.zeros((2, 32, CARD_VALUE_ACE + 1), dtype=bool)
+    for soft in (False, True):
+        for total in range(2, 22):
+            for dealer_up in range(2, CARD_VALUE_ACE + 1):
+                table[int(soft), total, dealer_up] = bool(strategy(total, soft, dealer_up))
+    return table
+
+
+def prefix_values(cards):
+    """
+    Hand value after each card, for every row at once.
+
+    Args:
+        cards: (rounds, k) array of card values, Ace as CARD_VALUE_ACE
+
+    Returns:
+        tuple: (totals, soft) arrays of shape (rounds, k); column j scores cards[:, :j+1]
+    """
+    is_ace = cards == CARD_VALUE_ACE
+    hard = np.cumsum(np.where(is_ace, 1, cards), axis=1, dtype=np.int16)
+    # At most one Ace can count as 11 without busting
+    soft = (np.cumsum(is_ace, axis=1) > 0) & (hard + 10 <= 21)
+    return np.where(soft, hard + 10, hard), soft
+
+
+def max_hits(deck):
+    """Hits after which any hand from this shoe has busted: even its smallest cards, Aces as 1, pass 21."""
+    low_totals = np.cumsum(np.sort(np.where(deck == CARD_VALUE_ACE, 1, deck)))
+    return int(np.argmax(low_totals > 21)) + 1 - 2  # Cards in the smallest busted hand, less the two dealt
+
+
+def simulate_batch(rng, deck, table, size, hit_soft_17=False):
+    """
+    Play `size` rounds of one strategy.
+
+    Args:
+        deck: Card values of one full shoe, shuffled afresh for every round
+        hit_soft_17: The dealer hits a soft 17 instead of standing
+
+    Returns:
+        tuple: (wins, losses, ties) counts
+    """
+    rows = np.arange(size)
+    # One independently shuffled deck per row
+    shoes = rng.permuted(np.tile(deck, (size, 1)), axis=1)
+    dealer_up = shoes[:, 2]
+    hit_limit = max_hits(deck)
+
+    # Player: the two initial cards, then hits from the top of the deck (after the dealer's two)
+    player = np.concatenate((shoes[:, 0:2], shoes[:, 4:4 + hit_limit]), axis=1)
+    p_totals, p_soft = prefix_values(player)
+    wants_hit = table[p_soft.astype(np.intp), np.minimum(p_totals, 31), dealer_up[:, None]]
+    # Decisions start with two cards; the first column that stands or busts ends the turn
+    stops = np.argmax(~(wants_hit[:, 1:] & (p_totals[:, 1:] <= 21)), axis=1) + 1
+    player_total = p_totals[rows, stops]
+    hits = stops - 1
+
+    # Dealer: two initial cards, then hits from wherever the player stopped drawing
+    draw_index = (4 + hits)[:, None] + np.arange(hit_limit)
+    dealer = np.concatenate((shoes[:, 2:4], np.take_along_axis(shoes, draw_index, axis=1)), axis=1)
+    d_totals, d_soft = prefix_values(dealer)
+    d_stands = d_totals >= DEALER_STAND
+    if hit_soft_17:
+        d_stands &= ~((d_totals == DEALER_STAND) & d_soft)
+    d_stops = np.argmax(d_stands[:, 1:], axis=1) + 1
+    dealer_total = d_totals[rows, d_stops]
+
+    busted = player_total > 21
+    wins = ~busted & ((dealer_total > 21) | (player_total > dealer_total))
+    ties = ~busted & (dealer_total <= 21) & (player_total == dealer_total)
+    win_count = int(wins.sum())
+    tie_count = int(ties.sum())
+    return win_count, size - win_count - tie_count, tie_count
+
+
+def simulate(strategies, rounds=1_000_000, batch_size=100_000, seed=None, decks=1, hit_soft_17=False):
+    """
+    Estimate outcome rates and EV per strategy with even-money payouts, under one rule set.
+
+    Args:
+        strategies: dict of name -> strategy callable (see strategy.py)
+        rounds: Rounds to play per strategy
+        seed: Seed for numpy.random.default_rng, for reproducible runs
+        decks: Decks in the shoe
+        hit_soft_17: The dealer hits a soft 17 instead of standing
+
+    Returns:
+        dict: name -> {'rounds', 'decks', 'hit_soft_17', 'win', 'loss', 'tie', 'ev', 'ev_stderr'}
+    """
+    if np is None:
+        raise ImportError("simulation requires NumPy: pip install numpy")
+    rng = np.random.default_rng(seed)
+    deck = np.tile(np.array([CARD_ID_VALUES[card] for card in DECK_CARDS], dtype=np.int16), decks)
+    results = {}
+    for name, strategy in strategies.items():
+        table = policy_table(strategy)
+        wins = losses = ties = 0
+        remaining = rounds
+        while remaining > 0:
+            size = min(batch_size, remaining)
+            w, l, t = simulate_batch(rng, deck, table, size, hit_soft_17)
+            wins, losses, ties = wins + w, losses + l, ties + t
+            remaining -= size
+        ev = (wins - losses) / rounds
+        # Per-round payout is +1/-1/0, so its variance is P(win) + P(loss) - ev^2
+        variance = (wins + losses) / rounds - ev * ev
+        results[name] = {
+            'rounds': rounds,
+            'decks': decks,
+            'hit_soft_17': hit_soft_17,
+            'win': wins / rounds,
+            'loss': losses / rounds,
+            'tie': ties / rounds,
+            'ev': ev,
+            'ev_stderr': math.sqrt(variance / rounds),
+        }
+    return results
+
+
+def describe_rules(decks, hit_soft_17):
+    return f"{decks} deck{'s' if decks != 1 else ''}, dealer {'hits' if hit_soft_17 else 'stands on'} soft 17"
+
+
+def compare_with_server(result, report):
+    """
+    z-score of the simulated win rate against a loadgen report from a live server.
+
+    |z| well below 3 means the socket path and the simulation agree.
+    """
+    n = report['rounds']
+    p = result['win']
+    observed = report['wins'] / n
+    return (observed - p) / math.sqrt(p * (1 - p) / n)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Blackijecky Monte Carlo simulation")
+    parser.add_argument("--rounds", type=int, default=1_000_000, help="rounds per strategy")
+    parser.add_argument("--batch-size", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--strategy", action="append", choices=sorted(STRATEGIES),
+                        help="strategy to evaluate (repeatable, default: all)")
+    parser.add_argument("--decks", type=int, action="append",
+                        help="decks in the shoe (repeatable, default: 1); the first is also used to verify")
+    parser.add_argument("--soft-17", action="append", choices=("stand", "hit"),
+                        help="dealer rule on soft 17 (repeatable, default: stand, as the server plays)")
+    parser.add_argument("--verify-port", type=int, default=None,
+                        help="also play rounds against a local server on this port and compare")
+    parser.add_argument("--verify-rounds", type=int, default=20_000)
+    parser.add_argument("--verify-stream", action="store_true",
+                        help="verify with protocol v2 sessions, against the hit-below policy the server plays")
+    args = parser.parse_args()
+
+    names = args.strategy or sorted(STRATEGIES)
+    deck_counts = args.decks or [1]
+    soft_17_rules = [rule == "hit" for rule in args.soft_17 or ["stand"]]
+    results = {}
+    for decks in deck_counts:
+        for hit_soft_17 in soft_17_rules:
+            print(describe_rules(decks, hit_soft_17))
+            results[decks, hit_soft_17] = simulate({name: STRATEGIES[name] for name in names}, args.rounds,
+                                                   args.batch_size, args.seed, decks, hit_soft_17)
+            for name in names:
+                r = results[decks, hit_soft_17][name]
+                print(f"{name:>8}: win {r['win']:.4f}  loss {r['loss']:.4f}  tie {r['tie']:.4f}  "
+                      f"EV {r['ev']:+.4f} ± {r['ev_stderr']:.4f}")
+
+    if args.verify_port is not None:
+        import asyncio
+        from loadgen import run_load
+        # The server stands on soft 17; start it with --decks matching the first --decks and --penetration 0
+        server_rules = (deck_counts[0], False)
+        print(f"Verifying against port {args.verify_port}: {describe_rules(*server_rules)}")
+        for name in names:
+            if args.verify_stream:
+                # A streamed session is played by the server from the policy alone, so simulate that
+                policy = policy_strategy(*hit_below_policy(STRATEGIES[name]))
+                expected = simulate({name: policy}, args.rounds, args.batch_size, args.seed, *server_rules)[name]
+            elif server_rules in results:
+                expected = results[server_rules][name]
+            else:
+                expected = simulate({name: STRATEGIES[name]}, args.rounds, args.batch_size, args.seed,
+                                    *server_rules)[name]
+            report = asyncio.run(run_load("127.0.0.1", args.verify_port, 100,
+                                          args.verify_rounds // 100, STRATEGIES[name], stream=args.verify_stream))
+            z = compare_with_server(expected, report)
+            print(f"{name:>8}: server win rate {report['wins'] / report['rounds']:.4f} "
+                  f"over {report['rounds']} rounds, z = {z:+.2f}")
@@ -0,0 +1,87 @@
+"""
+Decision strategies for headless Blackijecky players.
+
+A strategy is any callable strategy(player_sum, soft, dealer_up) -> bool that
+returns True to hit and False to stand. dealer_up is the game value of the
+dealer's visible card (2-11, Ace is CARD_VALUE_ACE).
+
+Protocol v2 sessions send a strategy as a standing policy instead: for each
+dealer up-card, the hard and soft totals the player hits below.
+"""
+from constants import *
+from decision_table import DecisionTable
+
+UP_CARDS = range(2, CARD_VALUE_ACE + 1)  # Policy index is dealer_up - 2
+
+
+def basic_strategy(player_sum, soft, dealer_up):
+    """Hit/stand basic strategy (no doubles or splits), dealer stands on all 17s."""
+    if soft:
+        if player_sum <= 17:
+            return True
+        # Soft 18 only hits against a strong up-card
+        return player_sum == 18 and dealer_up >= 9
+    if player_sum <= 11:
+        return True
+    if player_sum == 12:
+        return not 4 <= dealer_up <= 6
+    if player_sum <= 16:
+        return dealer_up >= 7
+    return False
+
+
+def mimic_dealer(player_sum, soft, dealer_up):
+    """Play like the house: hit below 17."""
+    return player_sum < 17
+
+
+def always_stand(player_sum, soft, dealer_up):
+    return False
+
+
+_decision_table = None
+
+
+def optimal_strategy(player_sum, soft, dealer_up):
+    """Exact-EV table for the server's default rules (see decision_table.py), opened on first use."""
+    global _decision_table
+    if _decision_table is None:
+        _decision_table = DecisionTable()
+    return _decision_table(player_sum, soft, dealer_up)
+
+
+def hit_below_policy(strategy):
+    """
+    Tabulate a strategy as "hit below N versus up-card" thresholds.
+
+    Exact for strategies that keep standing once they stand (everything in
+    STRATEGIES); others are cut off at their lowest standing total.
+
+    Returns:
+        tuple: (hard, soft) bytes of one threshold per dealer up-card 2-11
+    """
+    def first_stand(soft, dealer_up):
+        # Two cards total at least 4 hard, 12 soft (A+A)
+        for total in range(12 if soft else 4, 22):
+            if not strategy(total, soft, dealer_up):
+                return total
+        return 22
+
+    hard = bytes(first_stand(False, dealer_up) for dealer_up in UP_CARDS)
+    soft = bytes(first_stand(True, dealer_up) for dealer_up in UP_CARDS)
+    return hard, soft
+
+
+def policy_strategy(hard, soft):
+    """Strategy callable that plays a (hard, soft) hit-below policy."""
+    def strategy(player_sum, is_soft, dealer_up):
+        return player_sum < (soft if is_soft else hard)[dealer_up - 2]
+    return strategy
+
+
+STRATEGIES = {
+    'optimal': optimal_strategy,
+    'basic': basic_strategy,
+    'dealer': mimic_dealer,
+    'stand': always_stand,
+}
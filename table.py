@@ -0,0 +1,228 @@
+"""
+Multi-seat tables for the asyncio server.
+
+Sessions are seated at shared tables. Each round deals one dealer hand for
+every seat, collects the seats' decisions concurrently, then plays the
+dealer once and broadcasts the reveal and hits to every seat still standing.
+Each seat sees exactly the packet sequence of a private play_round, so
+existing clients work unchanged.
+"""
+import asyncio
+import math
+import time
+from constants import *
+from server import SessionEvicted
+from protocol import PayloadBatch, DECISION_STRUCT
+from scoring import HandState, CARD_ID_VALUES, NO_CARD, DECK_CARDS, encode_card, play_dealer, settle
+from shoe import HAND_CARDS
+
+
+class Seat:
+    """One player's session while it sits at a table."""
+
+    def __init__(self, server, reader, writer, team_name, rounds, deadline=None, number=0):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.team_name = team_name
+        self.rounds_left = rounds
+        self.deadline = deadline  # Session deadline, see server.session_deadline
+        self.number = number      # Session number for the round log
+        self.batch = PayloadBatch()
+        self.hand = None
+        self.cards = bytearray()  # This seat's round in play_round deal order, for the round log
+        self.hits = self.decisions = 0
+        self.standing = False  # Still in the round when the dealer plays
+        self.left = asyncio.get_running_loop().create_future()
+
+    def send(self, status, card):
+        rank, suit = encode_card(card)
+        self.batch.add(status, rank, suit)
+
+    async def flush(self):
+        self.server.write_batch(self.writer, self.batch)
+        await self.server.drain(self.writer)
+
+    def leave(self, completed):
+        if not self.left.done():
+            self.left.set_result(completed)
+
+
+class Table:
+    def __init__(self, server, size):
+        self.server = server
+        self.size = size
+        # Every seat and the dealer may draw a full hand in one round; the shoe must hold them
+        # all, or a mid-round reshuffle could deal a card that is already on the table
+        self.reserve = (size + 1) * HAND_CARDS
+        self.shoe = server.new_shoe(max(server.decks, math.ceil(self.reserve / len(DECK_CARDS))))
+        self.seats = []
+        self.joining = []  # Seated at the start of the next round
+        self.closed = False
+
+    @property
+    def free_seats(self):
+        if self.closed:
+            return 0
+        return self.size - len(self.seats) - len(self.joining)
+
+    async def run(self):
+        try:
+            while self.seats or self.joining:
+                self.seats.extend(self.joining)
+                self.joining.clear()
+                await self.play_round()
+                for seat in self.seats:
+                    if seat.rounds_left == 0:
+                        seat.leave(True)
+                    elif self.server.drain_expired():
+                        self.server.evict(SessionEvicted('evicted_drain'))
+                        seat.leave(False)
+                self.seats = [seat for seat in self.seats if not seat.left.done()]
+        except Exception as e:
+            self.server.log(f"Table error: {e}")
+        finally:
+            # Set without awaiting after the last check, so nobody joins an empty table
+            self.closed = True
+            # A round that failed on the dealer's side must not leave its sessions waiting forever
+            for seat in self.seats + self.joining:
+                seat.leave(False)
+
+    async def play_round(self):
+        started = time.perf_counter()
+        shoe = self.shoe
+        shoe.start_round(self.reserve)
+
+        # Deal like a casino: one card to each seat, the dealer's up-card, second cards, hole card
+        first_cards = [shoe.deal() for _ in self.seats]
+        dealer_up_card = shoe.deal()
+        second_cards = [shoe.deal() for _ in self.seats]
+        dealer_hole_card = shoe.deal()
+
+        for seat, first, second in zip(self.seats, first_cards, second_cards):
+            seat.hand = HandState(CARD_ID_VALUES[first], CARD_ID_VALUES[second])
+            seat.cards[:] = (first, second, dealer_up_card, dealer_hole_card)
+            seat.hits = seat.decisions = 0
+            seat.standing = False
+            seat.send(RESULT_CONTINUE, first)
+            seat.send(RESULT_CONTINUE, second)
+            seat.send(RESULT_CONTINUE, dealer_up_card)
+
+        await asyncio.gather(*(self.play_seat(seat) for seat in self.seats))
+
+        standing = [seat for seat in self.seats if seat.standing]
+        if not standing:
+            # Everyone busted or left; the dealer's hand is never shown
+            self.server.round_time.observe(time.perf_counter() - started)
+            return
+
+        # Dealer turn, packed once and written to every standing seat
+        dealer_sum, dealer_hits = play_dealer(dealer_up_card, dealer_hole_card, shoe.deal)
+        dealer_batch = PayloadBatch()
+        dealer_batch.add(RESULT_CONTINUE, *encode_card(dealer_hole_card))
+        for new_card in dealer_hits:
+            dealer_batch.add(RESULT_CONTINUE, *encode_card(new_card))
+        dealer_packets = dealer_batch.take()
+
+        for seat in standing:
+            result = settle(seat.hand.total, dealer_sum)
+            seat.writer.write(dealer_packets)
+            self.server.stats.incr('bytes_sent', len(dealer_packets))
+            seat.send(result, NO_CARD)
+            seat.rounds_left -= 1
+            self.server.record_result(result)
+            seat.cards.extend(dealer_hits)
+            self.log_seat(seat, result)
+            # Buffered without waiting: a seat that stopped reading is evicted on its
+            # next flush, while the other seats are deciding, not by holding up the table
+            self.server.write_batch(seat.writer, seat.batch)
+
+        self.server.round_time.observe(time.perf_counter() - started)
+
+    async def play_seat(self, seat):
+        """Run one seat's turn; a seat that times out or misbehaves leaves the table."""
+        try:
+            while True:
+                if seat.hand.busted:
+                    seat.send(RESULT_LOSS, NO_CARD)
+                    seat.rounds_left -= 1
+                    self.server.record_result(RESULT_LOSS)
+                    self.log_seat(seat, RESULT_LOSS)
+                    await seat.flush()
+                    return
+
+                await seat.flush()
+                timeout, reason = self.server.decision_timeout_for(seat.deadline)
+                waiting_since = time.perf_counter()
+                try:
+                    decision_raw = await asyncio.wait_for(seat.reader.readexactly(DECISION_STRUCT.size),
+                                                          timeout)
+                except asyncio.TimeoutError:
+                    raise SessionEvicted(reason)
+                self.server.decision_wait.observe(time.perf_counter() - waiting_since)
+                self.server.stats.incr('bytes_received', DECISION_STRUCT.size)
+                cookie, msg_type, decision_bytes = DECISION_STRUCT.unpack(decision_raw)
+                if cookie != MAGIC_COOKIE:
+                    self.server.protocol_error('error_cookie', f"Invalid decision packet from {seat.team_name}")
+                    seat.leave(False)
+                    return
+                if msg_type != MSG_TYPE_PAYLOAD:
+                    self.server.protocol_error('error_type', f"Invalid decision packet from {seat.team_name}")
+                    seat.leave(False)
+                    return
+
+                decision = decision_bytes.decode('utf-8', errors='ignore').strip('\x00').lower()
+                seat.decisions += 1
+                if not decision.startswith('h'):
+                    seat.standing = True
+                    return
+                seat.hits |= 1 << (seat.decisions - 1)
+                new_card = self.shoe.deal()
+                seat.hand.add(CARD_ID_VALUES[new_card])
+                seat.cards.append(new_card)
+                seat.send(RESULT_CONTINUE, new_card)
+        except SessionEvicted as e:
+            self.server.evict(e)
+            seat.leave(False)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            self.server.protocol_error('error_disconnected', f"{seat.team_name} disconnected mid-round")
+            seat.leave(False)
+        except Exception as e:
+            self.server.protocol_error('error_client', f"Client error: {e}")
+            seat.leave(False)
+
+    def log_seat(self, seat, result):
+        """Log a seat's round as if it had been dealt privately, in play_round order."""
+        if self.server.round_log is not None:
+            self.server.round_log.record(seat.number, seat.team_name.encode('utf-8'), *self.shoe.round_start,
+                                         seat.cards, seat.hits, seat.decisions, result)
+
+
+class TableScheduler:
+    """Seats incoming sessions at the first table with a free seat, opening tables as needed."""
+
+    def __init__(self, server, table_size):
+        self.server = server
+        self.table_size = table_size
+        self.tables = set()
+
+    async def play(self, reader, writer, team_name, rounds, deadline=None, number=0):
+        """
+        Seat a session and wait until it has played its rounds or left.
+
+        Returns:
+            bool: True if every round was played
+        """
+        if rounds == 0:
+            return True
+        seat = Seat(self.server, reader, writer, team_name, rounds, deadline, number)
+        table = next((t for t in self.tables if t.free_seats > 0), None)
+        if table is None:
+            table = Table(self.server, self.table_size)
+            self.tables.add(table)
+            table.joining.append(seat)
+            task = asyncio.create_task(table.run())
+            task.add_done_callback(lambda _: self.tables.discard(table))
+        else:
+            table.joining.append(seat)
+        return await seat.left